@@ -1,5 +1,28 @@
 from celery import Celery
+from celery.concurrency import get_implementation
+from celery.concurrency.prefork import TaskPool as PreforkPool
+from celery.signals import worker_init
 
 app = Celery("wis2watch")
 app.config_from_object("django.conf:settings", namespace="CELERY")
 app.autodiscover_tasks()
+
+
+@worker_init.connect
+def check_single_process_pool(sender, **kwargs):
+    """
+    Refuse to start a worker running MQTT clients in several processes
+    without the Redis locks that keep them from monitoring a node twice.
+    """
+    from django.conf import settings
+    
+    if getattr(settings, 'WIS2WATCH_MQTT_MULTI_PROCESS', True):
+        return
+    
+    pool_cls = get_implementation(sender.pool_cls)
+    if issubclass(pool_cls, PreforkPool) and sender.concurrency > 1:
+        # Signal handler errors are only logged, SystemExit stops the worker
+        raise SystemExit(
+            f"WIS2WATCH_MQTT_MULTI_PROCESS is disabled but the worker runs {sender.concurrency} "
+            f"prefork processes. Use --pool solo or --pool threads, or --concurrency 1."
+        )
@@ -256,6 +256,19 @@ CELERY_SINGLETON_BACKEND_CLASS = (
 CELERY_RESULT_BACKEND = 'django-db'
 CELERY_RESULT_EXTENDED = True
 
+# MQTT message batches are sent as zstd-compressed msgpack
+CELERY_ACCEPT_CONTENT = ['json', 'msgpack']
+
+# Publish MQTT message batches through Celery's pooled producers.
+# Disable to fall back to plain .delay() calls.
+WIS2WATCH_MQTT_USE_PRODUCER_POOL = env.bool("WIS2WATCH_MQTT_USE_PRODUCER_POOL", default=True)
+
+# Coordinate node ownership across worker processes with Redis locks.
+# Disable when a single process runs all MQTT clients, the worker then has to
+# use the solo or threads pool (or prefork with a concurrency of 1) and
+# refuses to start otherwise.
+WIS2WATCH_MQTT_MULTI_PROCESS = env.bool("WIS2WATCH_MQTT_MULTI_PROCESS", default=True)
+
 CACHES = {
     "default": {
         "BACKEND": "django_redis.cache.RedisCache",
@@ -329,4 +342,8 @@ CELERY_BEAT_SCHEDULE = {
         'task': 'wis2watch.core.tasks.run_sync_all_nodes',
         'schedule': 3600.0,  # Every hour
     },
+    'beat-heartbeat': {
+        'task': 'wis2watch.mqtt.tasks.beat_heartbeat',
+        'schedule': 60.0,  # Every minute
+    },
 }
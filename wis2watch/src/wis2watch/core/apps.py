@@ -10,3 +10,6 @@ class CoreConfig(AppConfig):
     name = "wis2watch.core"
     label = "wis2watchcore"
     verbose_name = "WiS2Watch Core"
+    
+    def ready(self):
+        from . import signals  # noqa: F401
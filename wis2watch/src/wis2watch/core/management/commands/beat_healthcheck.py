@@ -0,0 +1,17 @@
+import time
+
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+
+from wis2watch.mqtt.constants import BEAT_HEARTBEAT_KEY
+
+
+class Command(BaseCommand):
+    help = 'Exits non-zero if the Celery beat heartbeat has not been written recently'
+    
+    def handle(self, *args, **options):
+        heartbeat = cache.get(BEAT_HEARTBEAT_KEY)
+        if heartbeat is None:
+            raise CommandError("No Celery beat heartbeat found, beat or the workers may be stalled")
+        
+        self.stdout.write(self.style.SUCCESS(f"Last beat heartbeat {time.time() - heartbeat:.0f}s ago"))
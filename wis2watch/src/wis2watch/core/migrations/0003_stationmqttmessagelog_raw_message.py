@@ -0,0 +1,23 @@
+# Generated by Django 5.2.7 on 2026-10-15 09:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wis2watchcore', '0002_wis2node_verify_ssl'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='stationmqttmessagelog',
+            name='raw_message',
+            field=models.BinaryField(help_text='Complete raw MQTT message, zstd-compressed JSON', null=True),
+        ),
+        migrations.AlterField(
+            model_name='stationmqttmessagelog',
+            name='raw_json',
+            field=models.JSONField(blank=True, help_text='Complete raw MQTT message, for messages stored before compression', null=True),
+        ),
+    ]
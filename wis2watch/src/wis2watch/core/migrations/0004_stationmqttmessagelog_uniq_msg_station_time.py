@@ -0,0 +1,29 @@
+# Generated by Django 5.2.7 on 2026-10-15 09:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wis2watchcore', '0003_stationmqttmessagelog_raw_message'),
+    ]
+
+    operations = [
+        # Drop duplicates stored before the constraint existed, keeping the first copy
+        migrations.RunSQL(
+            sql="""
+                DELETE FROM wis2watchcore_stationmqttmessagelog a
+                USING wis2watchcore_stationmqttmessagelog b
+                WHERE a.message_id = b.message_id
+                  AND a.station_id = b.station_id
+                  AND a.time = b.time
+                  AND a.id > b.id
+            """,
+            reverse_sql=migrations.RunSQL.noop,
+        ),
+        migrations.AddConstraint(
+            model_name='stationmqttmessagelog',
+            constraint=models.UniqueConstraint(fields=('message_id', 'station', 'time'), name='uniq_msg_station_time'),
+        ),
+    ]
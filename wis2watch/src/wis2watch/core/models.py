@@ -1,5 +1,8 @@
+import orjson
+import zstandard
 from django.contrib.gis.db import models
 from django.contrib.gis.geos import Polygon
+from django.core.cache import cache
 from django.utils import timezone as dj_timezone
 from django.utils.translation import gettext_lazy as _
 from django_countries.fields import CountryField
@@ -25,6 +28,8 @@ class WIS2Node(TimeStampedModel):
         ('error', 'Error'),
     ]
     
+    TOPICS_CACHE_TIMEOUT = 3600  # seconds
+    
     name = models.CharField(
         max_length=200,
         help_text="Friendly name for this node"
@@ -145,6 +150,14 @@ class WIS2Node(TimeStampedModel):
         topics = [dataset.wmo_topic_hierarchy for dataset in datasets]
         return topics
     
+    def get_cached_topics(self):
+        """get_topics(), cached until one of the node's datasets changes"""
+        return cache.get_or_set(self.topics_cache_key(self.id), self.get_topics, timeout=self.TOPICS_CACHE_TIMEOUT)
+    
+    @staticmethod
+    def topics_cache_key(node_id):
+        return f"mqtt_node_{node_id}_topics"
+    
     @property
     def lock_key(self):
         return f"mqtt_node_{self.id}_lock"
@@ -191,6 +204,13 @@ class Dataset(TimeStampedModel):
     
     def __str__(self):
         return f"{self.title} ({self.identifier})"
+    
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Node the dataset was loaded with, so moving it also invalidates the previous node's topics
+        instance._loaded_node_id = instance.__dict__.get('node_id')
+        return instance
 
 
 @register_snippet
@@ -236,10 +256,26 @@ class StationMQTTMessageLog(TimescaleModel, TimeStampedModel, ):
     publish_datetime = models.DateTimeField(db_index=True, help_text="When message was published")
     received_datetime = models.DateTimeField(default=dj_timezone.now, help_text="When we received the message")
     canonical_link = models.URLField(max_length=1000, blank=True)
-    raw_json = models.JSONField(help_text="Complete raw MQTT message")
+    raw_json = models.JSONField(null=True, blank=True,
+                                help_text="Complete raw MQTT message, for messages stored before compression")
+    raw_message = models.BinaryField(null=True, help_text="Complete raw MQTT message, zstd-compressed JSON")
+    
+    class Meta:
+        constraints = [
+            # Backs the duplicate check of bulk_create(ignore_conflicts=True).
+            # TimescaleDB requires unique indexes to include the partitioning column
+            models.UniqueConstraint(fields=['message_id', 'station', 'time'], name='uniq_msg_station_time'),
+        ]
     
     def __str__(self):
         return f"{self.station.name} - {self.time}"
+    
+    @property
+    def message(self):
+        """The raw MQTT message, decompressed"""
+        if self.raw_message is None:
+            return self.raw_json
+        return orjson.loads(zstandard.ZstdDecompressor().decompress(bytes(self.raw_message)))
 
 
 @register_snippet
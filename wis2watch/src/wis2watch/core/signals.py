@@ -0,0 +1,25 @@
+import time
+
+from django.core.cache import cache
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from wis2watch.mqtt.constants import PK_CACHE_GENERATION_KEY
+
+from .models import Dataset, Station, WIS2Node
+
+
+@receiver(post_save, sender=Dataset)
+@receiver(post_delete, sender=Dataset)
+def invalidate_node_topics(sender, instance, **kwargs):
+    """Drop the cached topic list of the dataset's node, and of its previous node if it was moved"""
+    node_ids = {instance.node_id, getattr(instance, '_loaded_node_id', None)} - {None}
+    cache.delete_many([WIS2Node.topics_cache_key(node_id) for node_id in node_ids])
+    instance._loaded_node_id = instance.node_id
+
+
+@receiver(post_delete, sender=Station)
+@receiver(post_delete, sender=Dataset)
+def invalidate_message_pk_caches(sender, instance, **kwargs):
+    """Make MQTT workers drop cached Station/Dataset primary keys, a deleted one would fail the batch insert"""
+    cache.set(PK_CACHE_GENERATION_KEY, time.time_ns(), timeout=None)
@@ -1,3 +1,59 @@
-from django.test import TestCase
+from django.contrib.gis.geos import Point
+from django.core.cache import cache
+from django.test import TestCase, override_settings
 
-# Create your tests here.
+from wis2watch.mqtt.constants import PK_CACHE_GENERATION_KEY
+
+from .models import Dataset, Station, WIS2Node
+
+LOCMEM_CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+
+TOPIC = "origin/a/wis2/ke-test/data/core/weather/surface-based-observations/synop"
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class NodeTopicsCacheTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.node = WIS2Node.objects.create(name="Node A", country="KE", base_url="https://a.example.org")
+        cls.other_node = WIS2Node.objects.create(name="Node B", country="TZ", base_url="https://b.example.org")
+        Dataset.objects.create(
+            node=cls.node,
+            identifier="urn:wmo:md:ke-test:synop",
+            title="Synop",
+            wmo_data_policy="core",
+            wmo_topic_hierarchy=TOPIC,
+            raw_json={},
+        )
+    
+    def setUp(self):
+        cache.clear()
+    
+    def test_cached_topics_follow_dataset_changes(self):
+        self.assertEqual(self.node.get_cached_topics(), [TOPIC])
+        self.assertEqual(self.other_node.get_cached_topics(), [])
+        
+        # Moving the dataset invalidates both nodes
+        dataset = Dataset.objects.get(identifier="urn:wmo:md:ke-test:synop")
+        dataset.node = self.other_node
+        dataset.save()
+        
+        self.assertEqual(self.node.get_cached_topics(), [])
+        self.assertEqual(self.other_node.get_cached_topics(), [TOPIC])
+        
+        dataset.delete()
+        
+        self.assertEqual(self.other_node.get_cached_topics(), [])
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class MessagePrimaryKeyCacheTests(TestCase):
+    def test_deleting_a_station_changes_the_generation(self):
+        station = Station.objects.create(
+            wigos_id="0-404-0-63740", name="Test Station", location=Point(36.8, -1.3, 1600), raw_json={}
+        )
+        generation = cache.get(PK_CACHE_GENERATION_KEY)
+        
+        station.delete()
+        
+        self.assertNotEqual(cache.get(PK_CACHE_GENERATION_KEY), generation)
@@ -1,19 +1,282 @@
-import json
+import asyncio
+import itertools
 import logging
+import queue
+import random
+import socket
 import threading
-from datetime import datetime, timedelta
+from collections import deque
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
 from enum import Enum
 import time
+import uuid
+import weakref
 
+import orjson
 import paho.mqtt.client as mqtt
-from asgiref.sync import async_to_sync
+from fastrlock.rlock import FastRLock
+from paho.mqtt.matcher import MQTTMatcher
 from channels.layers import get_channel_layer
+from django.conf import settings
 from django.core.cache import cache
 from django.db import close_old_connections
 from django.utils import timezone as dj_timezone
 
 logger = logging.getLogger(__name__)
 
+# Channels group that all WebSocket status consumers subscribe to
+MQTT_STATUS_GROUP = "mqtt_status"
+
+# Error messages indexed by return code, unknown codes are formatted on demand
+_CONNECT_ERRORS = (
+    None,
+    "Connection refused - incorrect protocol version",
+    "Connection refused - invalid client identifier",
+    "Connection refused - server unavailable",
+    "Connection refused - bad username or password",
+    "Connection refused - not authorized",
+)
+
+_DISCONNECT_ERRORS = (
+    None,
+    "Disconnected - unacceptable protocol version",
+    "Disconnected - identifier rejected",
+    "Disconnected - server unavailable",
+    "Disconnected - bad authentication",
+    "Disconnected - not authorized",
+    None,
+    "Disconnected - no matching subscribers",
+)
+
+# Cache key kept alive by connected WebSocket status consumers. Nothing
+# removes it, it expires once no consumer has refreshed it for the TTL, so
+# a crashed consumer process or an evicted key can't leave it wrong for long.
+MQTT_STATUS_SUBSCRIBERS_KEY = "mqtt_status_subscribers"
+SUBSCRIBERS_PRESENCE_TTL = 60  # seconds
+
+# How long subscriber presence read from cache is trusted
+SUBSCRIBERS_REFRESH_INTERVAL = 5.0  # seconds
+
+_subscribers_present = False
+_subscribers_checked_at = None
+
+_CHANNEL_LAYER = None
+
+
+def _get_layer():
+    """Return the default channel layer, resolving it only once per process"""
+    global _CHANNEL_LAYER
+    if _CHANNEL_LAYER is None:
+        _CHANNEL_LAYER = get_channel_layer()
+    return _CHANNEL_LAYER
+
+
+def _has_subscribers() -> bool:
+    """
+    Return whether any WebSocket consumer is listening for status updates.
+    Presence is re-read from cache at most every SUBSCRIBERS_REFRESH_INTERVAL.
+    """
+    global _subscribers_present, _subscribers_checked_at
+    now_m = time.monotonic()
+    if (_subscribers_checked_at is None or
+            now_m - _subscribers_checked_at >= SUBSCRIBERS_REFRESH_INTERVAL):
+        try:
+            _subscribers_present = cache.get(MQTT_STATUS_SUBSCRIBERS_KEY) is not None
+        except Exception as e:
+            logger.error("Failed to read status subscriber presence: %s", e)
+            # Assume someone is listening rather than silently dropping updates
+            _subscribers_present = True
+        _subscribers_checked_at = now_m
+    return _subscribers_present
+
+
+# Received messages are collected and sent to consumers as one group
+# message per coalescing window instead of one per MQTT message, each as a
+# (node_id, topic, geometry, timestamp) tuple
+WS_COALESCE_INTERVAL = 0.5  # seconds
+WS_MAX_PENDING_MESSAGES = 500
+
+_pending_ws_messages = deque(maxlen=WS_MAX_PENDING_MESSAGES)
+
+# Latest status payload per node waiting to be broadcast
+_pending_ws_statuses = {}
+_pending_ws_statuses_lock = threading.Lock()
+
+_BG_LOOP = None
+_BG_LOOP_LOCK = threading.Lock()
+
+
+def _get_broadcast_loop():
+    """
+    Return the long-lived event loop used for channel layer calls and for
+    driving the MQTT broker sockets. The loop runs forever in a daemon thread
+    so that broadcasts don't pay for a new event loop on every message.
+    """
+    global _BG_LOOP
+    if _BG_LOOP is None:
+        with _BG_LOOP_LOCK:
+            if _BG_LOOP is None:
+                loop = asyncio.new_event_loop()
+                threading.Thread(
+                    target=loop.run_forever,
+                    name="wis2watch-mqtt-loop",
+                    daemon=True
+                ).start()
+                asyncio.run_coroutine_threadsafe(_flush_ws_messages_loop(), loop)
+                _BG_LOOP = loop
+    return _BG_LOOP
+
+
+def _dumps_frame(frame) -> str:
+    """Encode a websocket frame once, so consumers forward it without re-encoding per socket"""
+    return orjson.dumps(frame, option=orjson.OPT_NON_STR_KEYS).decode()
+
+
+async def _flush_ws_messages_loop():
+    """Send pending status updates and received-message notifications once per coalescing window"""
+    global _pending_ws_statuses
+    channel_layer = _get_layer()
+    if channel_layer is None:
+        # Nothing is ever queued without a channel layer
+        return
+    group_send = channel_layer.group_send
+    
+    while True:
+        await asyncio.sleep(WS_COALESCE_INTERVAL)
+        
+        sends = []
+        
+        if _pending_ws_statuses:
+            with _pending_ws_statuses_lock:
+                statuses = list(_pending_ws_statuses.values())
+                _pending_ws_statuses = {}
+            sends.append(("status updates", len(statuses), {
+                'type': 'statuses_updated',
+                'frames': [_dumps_frame({'type': 'status_update', 'data': status}) for status in statuses]
+            }))
+        
+        if _pending_ws_messages:
+            messages = [_pending_ws_messages.popleft() for _ in range(len(_pending_ws_messages))]
+            sends.append(("messages", len(messages), {
+                'type': 'messages_received',
+                'frames': [
+                    _dumps_frame({
+                        'type': 'message',
+                        'data': {
+                            'node_id': node_id,
+                            'topic': topic,
+                            'timestamp': timestamp,
+                            'geometry': geometry,
+                        }
+                    })
+                    for node_id, topic, geometry, timestamp in messages
+                ]
+            }))
+        
+        if not sends:
+            continue
+        
+        # Both group messages go out concurrently
+        results = await asyncio.gather(
+            *(group_send(MQTT_STATUS_GROUP, message) for _, _, message in sends),
+            return_exceptions=True
+        )
+        for (label, count, _), result in zip(sends, results):
+            if isinstance(result, Exception):
+                logger.error("Failed to broadcast %d %s: %s", count, label, result)
+
+
+# Messages received on Paho network threads, processed by ingest workers
+INGEST_WORKER_COUNT = 2
+# Messages beyond this backlog are dropped rather than growing memory without bound
+INGEST_QUEUE_MAX_SIZE = 10000
+
+_ingest_q = queue.SimpleQueue()
+_ingest_dropped = itertools.count(1)
+
+# Latest status per cache key, written to cache by the status writer in one
+# set_many per tick
+STATUS_WRITE_INTERVAL = 1.0  # seconds
+
+_pending_status = {}
+_pending_status_lock = threading.Lock()
+
+# Clients whose buffers the batch flusher checks for time-based flushes
+_flush_clients = weakref.WeakSet()
+_flush_clients_lock = threading.Lock()
+
+_background_threads = []
+_background_threads_lock = threading.Lock()
+
+
+def _ingest_worker():
+    while True:
+        client, topic, payload_bytes, received_at, now_m = _ingest_q.get()
+        client._process_message(topic, payload_bytes, received_at, now_m)
+
+
+def _status_writer():
+    """Write pending node statuses to cache, one set_many per tick"""
+    global _pending_status
+    while True:
+        time.sleep(STATUS_WRITE_INTERVAL)
+        
+        if not _pending_status:
+            continue
+        
+        with _pending_status_lock:
+            pending = _pending_status
+            _pending_status = {}
+        
+        try:
+            cache.set_many(pending, timeout=None)
+        except Exception as e:
+            logger.error("Failed to write status cache for %d nodes: %s", len(pending), e)
+
+
+def _register_flush_client(client):
+    with _flush_clients_lock:
+        _flush_clients.add(client)
+
+
+def _batch_flusher():
+    """
+    Flush buffers that have been waiting longer than BATCH_TIMEOUT, so idle
+    nodes don't hold messages until their next arrival. Due batches from all
+    nodes go out as a single Celery task.
+    """
+    while True:
+        time.sleep(MQTTNodeClient.BATCH_TIMEOUT / 2)
+        
+        with _flush_clients_lock:
+            clients = list(_flush_clients)
+        
+        now_m = time.monotonic()
+        batch = []
+        for client in clients:
+            if client._message_buffer and now_m - client._last_batch_flush_mono >= client.BATCH_TIMEOUT:
+                batch.extend(client._drain_buffer())
+        
+        if batch:
+            MQTTNodeClient._publish_batch(batch)
+
+
+def _ensure_background_threads():
+    """Start the ingest workers and status writer the first time a client needs them"""
+    if _background_threads:
+        return
+    with _background_threads_lock:
+        if _background_threads:
+            return
+        targets = [(f"wis2watch-mqtt-ingest-{i}", _ingest_worker) for i in range(INGEST_WORKER_COUNT)]
+        targets.append(("wis2watch-mqtt-status-writer", _status_writer))
+        targets.append(("wis2watch-mqtt-batch-flusher", _batch_flusher))
+        for name, target in targets:
+            thread = threading.Thread(target=target, name=name, daemon=True)
+            thread.start()
+            _background_threads.append(thread)
+
 
 class ClientState(Enum):
     """MQTT client connection states"""
@@ -24,8 +287,347 @@ class ClientState(Enum):
     ERROR = "error"
 
 
+@dataclass(slots=True)
+class ClientStats:
+    """Point-in-time statistics of an MQTTNodeClient"""
+    node_id: int
+    node_name: str
+    state: str
+    is_connected: bool
+    uptime_seconds: float | None
+    message_count: int
+    messages_per_minute: float
+    connection_attempts: int
+    successful_connections: int
+    failed_connections: int
+    error_count: int
+    last_error: str | None
+
+
+class MQTTBrokerConnection:
+    """
+    Paho client shared by all nodes that use the same broker and credentials.
+    Connection callbacks are fanned out to every registered node and messages
+    are dispatched to the node whose topics match.
+    
+    Instead of a Paho network thread per connection, the sockets of all
+    connections are driven from the shared broadcast event loop using Paho's
+    external loop callbacks. Reconnecting is handled here as a consequence.
+    """
+    
+    RECONNECT_MIN_DELAY = 1  # seconds
+    RECONNECT_MAX_DELAY = 120  # seconds
+    
+    KEEPALIVE = 60  # seconds
+    CONNECT_TIMEOUT = 10  # seconds
+    
+    # Socket tuning
+    SOCKET_RCVBUF = 1 << 20  # 1 MiB, room for a full burst of notifications
+    SOCKET_USER_TIMEOUT = 90  # seconds, drop dead peers before keepalive notices
+    SOCKET_KEEPIDLE = 30  # seconds idle before the first TCP keepalive probe
+    SOCKET_KEEPINTVL = 10  # seconds between probes
+    SOCKET_KEEPCNT = 3  # unanswered probes before the connection is dropped
+    
+    _connections = {}
+    _connections_lock = threading.Lock()
+    
+    __slots__ = (
+        'key', 'broker_host', 'broker_port', 'client', 'is_connected', 'started',
+        '_lock', '_nodes', '_matcher', '_loop', '_misc_task', '_connecting', '_closing',
+        '_reconnect_delay',
+    )
+    
+    def __init__(self, key: tuple, broker_host: str, broker_port: int,
+                 username: str = None, password: str = None):
+        self.key = key
+        self.broker_host = broker_host
+        self.broker_port = broker_port
+        self.is_connected = False
+        self.started = False
+        
+        self._lock = FastRLock()
+        self._nodes = {}
+        self._matcher = MQTTMatcher()
+        
+        # Only touched from the event loop thread
+        self._loop = _get_broadcast_loop()
+        self._misc_task = None
+        self._connecting = False
+        self._closing = False
+        # Only reset by a successful CONNACK, so a broker that accepts the TCP
+        # connection but refuses or drops the session is retried with backoff
+        self._reconnect_delay = self.RECONNECT_MIN_DELAY
+        
+        client_id = f"wis2watch_{uuid.uuid4().hex[:12]}_{int(datetime.now().timestamp())}"
+        self.client = mqtt.Client(client_id=client_id, protocol=mqtt.MQTTv5)
+        
+        if username and password:
+            self.client.username_pw_set(username, password)
+        
+        self.client.on_connect = self._on_connect
+        self.client.on_disconnect = self._on_disconnect
+        self.client.on_message = self._on_message
+        
+        self.client.on_socket_open = self._on_socket_open
+        self.client.on_socket_close = self._on_socket_close
+        self.client.on_socket_register_write = self._on_socket_register_write
+        self.client.on_socket_unregister_write = self._on_socket_unregister_write
+        
+        # Bound the TCP/TLS handshake, liveness afterwards is left to the MQTT
+        # keepalive and the TCP keepalive options set in _tune_socket
+        self.client.connect_timeout = self.CONNECT_TIMEOUT
+    
+    @classmethod
+    def attach(cls, node: "MQTTNodeClient") -> "MQTTBrokerConnection":
+        """
+        Register a node on the shared connection for its broker, creating
+        and starting the connection if this is the first node to use it.
+        """
+        key = (node.broker_host, node.broker_port, node.username, node.password)
+        with cls._connections_lock:
+            connection = cls._connections.get(key)
+            if connection is None:
+                connection = cls(key, node.broker_host, node.broker_port, node.username, node.password)
+                cls._connections[key] = connection
+            
+            with connection._lock:
+                connection._nodes[node.node_id] = node
+                # Several nodes may subscribe to the same filter. Tuples are
+                # replaced rather than mutated, so dispatch can iterate them
+                # without the lock.
+                for topic in dict.fromkeys(node.topics):
+                    connection._matcher[topic] = connection._topic_nodes(topic) + (node,)
+                
+                start = not connection.started
+                connection.started = True
+                already_connected = connection.is_connected
+        
+        if start:
+            try:
+                # connect_async only validates and stores the connection settings,
+                # the connection itself is opened on the event loop
+                connection.client.connect_async(connection.broker_host, connection.broker_port,
+                                                keepalive=cls.KEEPALIVE)
+            except Exception:
+                connection.detach(node)
+                raise
+            connection._loop.call_soon_threadsafe(connection._start_connecting)
+        elif already_connected:
+            # Connection is already up, so the node won't get an on_connect of its own
+            connection._subscribe(node.topics)
+            node._on_connect(connection.client, None, None, 0)
+        
+        return connection
+    
+    def detach(self, node: "MQTTNodeClient"):
+        """Unregister a node, closing the connection once no nodes are left"""
+        with self._connections_lock:
+            with self._lock:
+                self._nodes.pop(node.node_id, None)
+                unused_topics = []
+                for topic in dict.fromkeys(node.topics):
+                    remaining = tuple(n for n in self._topic_nodes(topic) if n is not node)
+                    if remaining:
+                        self._matcher[topic] = remaining
+                    else:
+                        try:
+                            del self._matcher[topic]
+                        except KeyError:
+                            pass
+                        unused_topics.append(topic)
+                last_node = not self._nodes
+            
+            if last_node and self._connections.get(self.key) is self:
+                del self._connections[self.key]
+        
+        if last_node:
+            self._loop.call_soon_threadsafe(self._close)
+        elif unused_topics and self.is_connected:
+            # Topics still used by other nodes stay subscribed
+            self.client.unsubscribe(unused_topics)
+    
+    def reconnect(self):
+        """Start reconnecting now if the connection is down and no attempt is pending"""
+        self._loop.call_soon_threadsafe(self._start_connecting)
+    
+    def _close(self):
+        # Stops pending reconnects, a socket opening afterwards is closed in _watch_socket
+        self._closing = True
+        self.client.disconnect()
+    
+    def _topic_nodes(self, topic: str) -> tuple:
+        try:
+            return self._matcher[topic]
+        except KeyError:
+            return ()
+    
+    def _start_connecting(self, backoff: bool = False):
+        if not self._connecting and not self._closing:
+            self._connecting = True
+            self._loop.create_task(self._connect(backoff))
+    
+    async def _connect(self, backoff: bool = False):
+        """Open the connection, retrying with exponential backoff, optionally waiting before the first attempt"""
+        try:
+            if backoff:
+                await self._backoff()
+            while not self._closing:
+                try:
+                    # Blocking DNS/TCP connect, keep it off the event loop
+                    await self._loop.run_in_executor(None, self.client.reconnect)
+                    return
+                except Exception as e:
+                    logger.warning(
+                        "Connection to broker %s:%s failed, retrying in up to %ss: %s",
+                        self.broker_host, self.broker_port, self._reconnect_delay, e
+                    )
+                await self._backoff()
+        finally:
+            self._connecting = False
+    
+    async def _backoff(self):
+        """Wait out the current reconnect delay and double it for the next attempt"""
+        delay = self._reconnect_delay
+        self._reconnect_delay = min(delay * 2, self.RECONNECT_MAX_DELAY)
+        # Jitter keeps connections to a flapping broker from retrying in lockstep
+        await asyncio.sleep(delay / 2 + random.uniform(0, delay / 2))
+    
+    async def _misc_loop(self):
+        """Drive Paho's keepalive and timeout handling while the socket is open"""
+        while self.client.loop_misc() == mqtt.MQTT_ERR_SUCCESS:
+            await asyncio.sleep(1)
+    
+    # Paho socket callbacks may run on any thread. They run inline when
+    # already on the event loop (so the socket is still open when it is
+    # unregistered) and are handed over to it otherwise.
+    
+    def _call_in_loop(self, callback, *args):
+        try:
+            in_loop = asyncio.get_running_loop() is self._loop
+        except RuntimeError:
+            in_loop = False
+        
+        if in_loop:
+            callback(*args)
+        else:
+            self._loop.call_soon_threadsafe(callback, *args)
+    
+    def _on_socket_open(self, client, userdata, sock):
+        self._tune_socket(sock)
+        self._call_in_loop(self._watch_socket, sock)
+    
+    def _on_socket_close(self, client, userdata, sock):
+        self._call_in_loop(self._unwatch_socket, sock)
+    
+    def _on_socket_register_write(self, client, userdata, sock):
+        self._call_in_loop(self._watch_socket_writes, sock)
+    
+    def _on_socket_unregister_write(self, client, userdata, sock):
+        self._call_in_loop(self._unwatch_socket_writes, sock)
+    
+    def _tune_socket(self, sock):
+        """Disable Nagle, enlarge the receive buffer and enable TCP keepalives"""
+        options = [
+            (socket.IPPROTO_TCP, socket.TCP_NODELAY, 1),
+            (socket.SOL_SOCKET, socket.SO_RCVBUF, self.SOCKET_RCVBUF),
+            (socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1),
+        ]
+        # Not available on every platform (TCP_USER_TIMEOUT is Linux only)
+        for name, value in (
+                ('TCP_KEEPIDLE', self.SOCKET_KEEPIDLE),
+                ('TCP_KEEPINTVL', self.SOCKET_KEEPINTVL),
+                ('TCP_KEEPCNT', self.SOCKET_KEEPCNT),
+                ('TCP_USER_TIMEOUT', self.SOCKET_USER_TIMEOUT * 1000),
+        ):
+            if hasattr(socket, name):
+                options.append((socket.IPPROTO_TCP, getattr(socket, name), value))
+        
+        for level, option, value in options:
+            try:
+                sock.setsockopt(level, option, value)
+            except (OSError, AttributeError) as e:
+                logger.debug("Could not set socket option %s for broker %s:%s: %s",
+                             option, self.broker_host, self.broker_port, e)
+    
+    def _watch_socket(self, sock):
+        if sock.fileno() == -1:
+            return
+        self._loop.add_reader(sock, self.client.loop_read)
+        self._misc_task = self._loop.create_task(self._misc_loop())
+        
+        if self._closing:
+            # Connected after the last node went away
+            self.client.disconnect()
+    
+    def _watch_socket_writes(self, sock):
+        if sock.fileno() != -1:
+            self._loop.add_writer(sock, self.client.loop_write)
+    
+    def _unwatch_socket_writes(self, sock):
+        try:
+            self._loop.remove_writer(sock)
+        except (OSError, ValueError):
+            # Socket was already closed
+            pass
+    
+    def _unwatch_socket(self, sock):
+        try:
+            self._loop.remove_writer(sock)
+            self._loop.remove_reader(sock)
+        except (OSError, ValueError):
+            # Socket was already closed
+            pass
+        
+        if self._misc_task:
+            self._misc_task.cancel()
+            self._misc_task = None
+        
+        if not self._closing:
+            # Closed by the broker or the network, including a refused CONNACK
+            self._start_connecting(backoff=True)
+    
+    def _snapshot_nodes(self) -> list:
+        with self._lock:
+            return list(self._nodes.values())
+    
+    def _subscribe(self, topics):
+        """Subscribe to topics with QoS 1 in a single SUBSCRIBE packet"""
+        # Nodes on the same broker may share topics, subscribe to each once
+        topics = list(dict.fromkeys(topics))
+        if not topics:
+            return
+        try:
+            self.client.subscribe([(topic, 1) for topic in topics])
+            logger.info("Subscribed to %d topics on broker %s:%s", len(topics), self.broker_host, self.broker_port)
+        except Exception as e:
+            logger.error("Failed to subscribe to topics on broker %s:%s: %s", self.broker_host, self.broker_port, e)
+    
+    def _on_connect(self, client, userdata, flags, rc, properties=None):
+        self.is_connected = rc == 0
+        nodes = self._snapshot_nodes()
+        if self.is_connected:
+            self._reconnect_delay = self.RECONNECT_MIN_DELAY
+            # One SUBSCRIBE for every node on this connection
+            self._subscribe(topic for node in nodes for topic in node.topics)
+        for node in nodes:
+            node._on_connect(client, userdata, flags, rc, properties)
+    
+    def _on_disconnect(self, client, userdata, rc, properties=None):
+        self.is_connected = False
+        for node in self._snapshot_nodes():
+            node._on_disconnect(client, userdata, rc, properties)
+    
+    def _on_message(self, client, userdata, msg):
+        for nodes in self._matcher.iter_match(msg.topic):
+            for node in nodes:
+                node._message_handler(client, userdata, msg)
+
+
 class MQTTNodeClient:
-    """Individual MQTT client for a single node with batching and throttling"""
+    """
+    Individual MQTT client for a single node with batching and throttling.
+    The underlying Paho connection is shared with other nodes on the same broker.
+    """
     
     # --- Configuration Constants ---
     
@@ -36,31 +638,63 @@ class MQTTNodeClient:
     BATCH_SIZE = 50  # Flush to DB after 50 messages
     BATCH_TIMEOUT = 5.0  # OR flush every 5 seconds
     
-    # WebSocket Throttling Settings
-    # 0.5s = Max 2 messages broadcast per second (Visual Sampling)
-    WS_BROADCAST_MIN_INTERVAL = 0.0
-    
     # Status Cache Update Rate
     STATUS_UPDATE_INTERVAL = 10  # seconds
     
     MAX_MESSAGE_TIMES_STORED = 1000
     
-    def __init__(self, node_id: int, broker_host: str, broker_port: int,
+    # Only every Nth per-message error is logged
+    ERROR_LOG_SAMPLE_RATE = 100
+    
+    # Status fields pushed to WebSocket consumers on state changes
+    _WS_FIELDS = ('node_id', 'node_name', 'state', 'is_connected', 'message_count', 'messages_per_minute')
+    
+    # Many clients live in one process, so avoid a per-instance __dict__
+    __slots__ = (
+        'node_id', 'node_name', '_cache_key', 'broker_host', 'broker_port',
+        'username', 'password', 'topics', '_connection', 'is_connected', '_status', '_lock', '_counter_lock',
+        'state', 'previous_state', 'state_changed_at',
+        'connection_attempts', 'successful_connections', 'failed_connections',
+        'last_connection_attempt', 'connected_at', 'disconnected_at',
+        'message_count', 'last_message_time', 'messages_per_minute', '_message_times',
+        '_message_counter',
+        '_last_status_update_mono', '_message_buffer', '_last_batch_flush_mono', '_message_handler',
+        'last_error', 'error_count', '_last_status', '_last_broadcast_state', '_channel_layer',
+        '_stop_event',
+        '__weakref__',
+    )
+    
+    def __init__(self, node_id: int, node_name: str, broker_host: str, broker_port: int,
                  username: str = None, password: str = None, topics: list = None):
         
-        from wis2watch.core.models import WIS2Node
-        
         self.node_id = node_id
+        self.node_name = node_name
+        self._cache_key = f"mqtt_node_{node_id}_status"
         self.broker_host = broker_host
         self.broker_port = broker_port
         self.username = username
         self.password = password
         self.topics = topics or []
-        self.client = None
+        self._connection = None
         self.is_connected = False
         
-        # Thread safety
-        self._lock = threading.RLock()
+        # Status fields that only change on state transitions, kept up to date
+        # by _refresh_status_template. Built statuses start from a copy of it.
+        self._status = {
+            'node_id': node_id,
+            'node_name': node_name,
+            'broker_host': broker_host,
+            'broker_port': broker_port,
+            'subscribed_topics': tuple(self.topics),
+            'subscription_count': len(self.topics),
+        }
+        
+        # Thread safety. _lock guards state and connection metadata,
+        # _counter_lock the batch buffer drain and error counter, so ingest
+        # workers don't contend with state changes. Take _lock first when
+        # both are needed.
+        self._lock = FastRLock()
+        self._counter_lock = threading.Lock()
         
         # State tracking
         self.state = ClientState.DISCONNECTED
@@ -74,77 +708,73 @@ class MQTTNodeClient:
         self.last_connection_attempt = None
         self.connected_at = None
         self.disconnected_at = None
+        self.last_error = None
+        self._refresh_status_template()
         
         # Message tracking
         self.message_count = 0
-        self.last_message_time = None
+        self.last_message_time = None  # Epoch seconds, converted when the status is built
         self.messages_per_minute = 0.0
-        self._message_times = []  # Store last 60 message timestamps
+        # Monotonic receive times within the rate window
+        self._message_times = deque(maxlen=self.MAX_MESSAGE_TIMES_STORED)
+        self._message_counter = itertools.count(1)
         
         # Throttling & Batching State
-        self._last_status_update = dj_timezone.now()
-        self._last_ws_broadcast = dj_timezone.now()  # For throttling WS
-        self._message_buffer = []  # <--- For DB batching
-        self._last_batch_flush = dj_timezone.now()  # For DB batching
+        # Throttle timestamps are time.monotonic() values, only used for intervals
+        now_m = time.monotonic()
+        self._last_status_update_mono = now_m
+        self._message_buffer = deque()  # <--- For DB batching
+        self._last_batch_flush_mono = now_m  # For DB batching
+        self._message_handler = self._make_message_handler()
         
         # Error tracking
-        self.last_error = None
         self.error_count = 0
         
-        try:
-            self.node = WIS2Node.objects.get(id=node_id)
-        except WIS2Node.DoesNotExist:
-            raise ValueError(f"Node {node_id} not found in database")
+        # Status dict most recently queued for the cache
+        self._last_status = None
         
-        self._stop_event = threading.Event()
+        # (state, is_connected) pair last pushed to WebSocket consumers
+        self._last_broadcast_state = None
+        
+        # Resolved once so broadcasts don't go back through the layer registry
+        self._channel_layer = _get_layer()
         
-        # Start the refresh thread immediately
-        self._refresh_thread = threading.Thread(target=self._lock_refresh_loop, daemon=True)
-        self._refresh_thread.start()
+        # Set once the client is stopped, its Redis lock is refreshed by the service
+        self._stop_event = threading.Event()
         
-        self._setup_client()
-        logger.info(f"MQTTNodeClient initialized for node {self.node_id} ({self.node.name})")
+        _register_flush_client(self)
+        _ensure_background_threads()
+        logger.info("MQTTNodeClient initialized for node %s (%s)", self.node_id, self.node_name)
     
-    def _change_state(self, new_state: ClientState, error: str = None):
-        """Change client state and track the transition"""
+    def _change_state(self, new_state: ClientState, error: str = None, now: datetime = None):
+        """Change client state and track the transition, optionally at a time the caller already took"""
         with self._lock:
             self.previous_state = self.state
             self.state = new_state
-            self.state_changed_at = dj_timezone.now()
+            self.state_changed_at = now or dj_timezone.now()
             
-            logger.info(
-                f"Node {self.node_id} state transition: "
-                f"{self.previous_state.value} -> {new_state.value}"
-            )
+            if logger.isEnabledFor(logging.INFO):
+                logger.info(
+                    "Node %s state transition: %s -> %s",
+                    self.node_id, self.previous_state.value, new_state.value
+                )
             
             if error:
                 self.last_error = error
-                self.error_count += 1
-                logger.error(f"Node {self.node_id} error: {error}")
+                with self._counter_lock:
+                    self.error_count += 1
+                logger.error("Node %s error: %s", self.node_id, error)
             
-            # Update cache and broadcast immediately on state change
-            self._update_status()
-            self._broadcast_status()
-    
-    def _setup_client(self):
-        """Setup MQTT client with callbacks"""
-        client_id = f"wis2watch_node_{self.node_id}_{int(datetime.now().timestamp())}"
-        self.client = mqtt.Client(client_id=client_id, protocol=mqtt.MQTTv5)
-        
-        if self.username and self.password:
-            self.client.username_pw_set(self.username, self.password)
-        
-        self.client.on_connect = self._on_connect
-        self.client.on_disconnect = self._on_disconnect
-        self.client.on_message = self._on_message
-        
-        self.client.reconnect_delay_set(min_delay=1, max_delay=120)
-        
-        # Set socket timeout to prevent hanging
-        try:
-            self.client._sock_set_timeout = lambda sock: sock.settimeout(10)
-        except AttributeError:
-            logger.warning(f"Could not set socket timeout for node {self.node_id}")
+            self._refresh_status_template()
+            
+            # Update cache immediately on state change, but only broadcast
+            # when the visible state actually differs from the last broadcast
+            self._queue_status(self._status_snapshot())
+            
+            broadcast_state = (new_state, self.is_connected)
+            if broadcast_state != self._last_broadcast_state:
+                self._last_broadcast_state = broadcast_state
+                self._broadcast_status()
     
     def _on_connect(self, client, userdata, flags, rc, properties=None):
         """Callback for when the client connects"""
@@ -153,25 +783,23 @@ class MQTTNodeClient:
         close_old_connections()
         
         if rc == 0:
-            logger.info(f"Node {self.node_id} ({self.node.name}) connected to MQTT broker")
+            logger.info("Node %s (%s) connected to MQTT broker", self.node_id, self.node_name)
             
+            now = dj_timezone.now()
             with self._lock:
                 self.is_connected = True
-                self.connected_at = dj_timezone.now()
+                self.connected_at = now
                 self.successful_connections += 1
             
-            for topic in self.topics:
-                try:
-                    client.subscribe(topic, qos=1)
-                    logger.info(f"Node {self.node_id} subscribed to topic: {topic}")
-                except Exception as e:
-                    logger.error(f"Failed to subscribe to {topic}: {e}")
+            # Topics are subscribed by the broker connection, in one packet
+            # for all nodes sharing it
             
-            self._change_state(ClientState.CONNECTED)
+            self._change_state(ClientState.CONNECTED, now=now)
         else:
             error_msg = self._get_connection_error_message(rc)
             logger.error(
-                f"Node {self.node_id} ({self.node.name}) connection failed: {error_msg}"
+                "Node %s (%s) connection failed: %s",
+                self.node_id, self.node_name, error_msg
             )
             
             with self._lock:
@@ -187,244 +815,307 @@ class MQTTNodeClient:
         close_old_connections()
         
         logger.warning(
-            f"Node {self.node_id} ({self.node.name}) disconnected from MQTT broker (rc={rc})"
+            "Node %s (%s) disconnected from MQTT broker (rc=%s)",
+            self.node_id, self.node_name, rc
         )
         
+        now = dj_timezone.now()
         with self._lock:
             self.is_connected = False
-            self.disconnected_at = dj_timezone.now()
+            self.disconnected_at = now
             
             if self.connected_at:
                 uptime = self.disconnected_at - self.connected_at
-                logger.info(f"Node {self.node_id} was connected for {uptime}")
+                logger.info("Node %s was connected for %s", self.node_id, uptime)
         
         if self.state == ClientState.STOPPING:
-            self._change_state(ClientState.DISCONNECTED)
+            self._change_state(ClientState.DISCONNECTED, now=now)
         else:
             error_msg = f"Unexpected disconnect (rc={rc})"
             if rc != 0:
                 error_msg = self._get_disconnect_error_message(rc)
-            self._change_state(ClientState.ERROR, error_msg)
+            self._change_state(ClientState.ERROR, error_msg, now=now)
+    
+    def _drain_buffer(self) -> list:
+        """Take everything currently in the message buffer"""
+        # Drain with popleft rather than swapping the deque, so a concurrent
+        # append always lands in a deque that will be flushed. The lock keeps
+        # an ingest worker and the batch flusher from draining at once.
+        with self._counter_lock:
+            buffer = self._message_buffer
+            batch = [buffer.popleft() for _ in range(len(buffer))]
+            self._last_batch_flush_mono = time.monotonic()
+        return batch
     
     def _flush_buffer(self):
         """Flush the current message buffer to the batch Celery task"""
         if not self._message_buffer:
             return
         
+        batch_to_process = self._drain_buffer()
+        if batch_to_process:
+            self._publish_batch(batch_to_process)
+    
+    @classmethod
+    def _publish_batch(cls, batch_to_process: list):
+        """Send a batch of message dicts to the batch Celery task"""
         # Import locally to avoid circular imports during startup
         from wis2watch.mqtt.tasks import process_mqtt_message_batch
         
-        with self._lock:
-            # Atomic swap to clear buffer
-            batch_to_process = self._message_buffer[:]
-            self._message_buffer = []
-            self._last_batch_flush = dj_timezone.now()
-        
         try:
-            # Send batch to Celery
-            process_mqtt_message_batch.delay(batch_to_process)
-            logger.debug(f"Flushed batch of {len(batch_to_process)} messages for node {self.node_id}")
+            # Send batch to Celery, reusing a pooled producer so each flush
+            # doesn't set up its own broker channel
+            if getattr(settings, 'WIS2WATCH_MQTT_USE_PRODUCER_POOL', True):
+                app = process_mqtt_message_batch.app
+                with app.producer_pool.acquire(block=True) as producer:
+                    process_mqtt_message_batch.apply_async(
+                        (batch_to_process,),
+                        producer=producer,
+                        retry=False
+                    )
+            else:
+                process_mqtt_message_batch.delay(batch_to_process)
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("Flushed batch of %d messages", len(batch_to_process))
         except Exception as e:
-            logger.error(f"Failed to queue batch task for node {self.node_id}: {e}")
+            logger.error("Failed to queue batch task for %d messages: %s", len(batch_to_process), e)
             # Note: In a critical system, you might want to re-buffer these
             # or dump them to a fallback file to avoid data loss.
     
-    def _on_message(self, client, userdata, msg):
-        """Callback for when a message is received"""
+    def _make_message_handler(self):
+        """
+        Build the callback for when a message is received.
+        Only updates reception counters and hands the raw payload to the
+        ingest workers so the Paho network thread is never held up. Everything
+        fixed for the client's lifetime is bound once as a closure variable,
+        so the per-message path doesn't repeat attribute lookups.
         
-        # Ensure we have a clean DB state for this thread
-        close_old_connections()
+        Messages are only ever delivered on the shared event loop thread, so
+        the counters have a single writer and are updated without the lock:
+        the count comes from an itertools counter, and expiring the rate
+        window is left to readers (see _refresh_message_rate).
+        """
+        node = self
+        count = self._message_counter.__next__
+        append_time = self._message_times.append
+        ingest = _ingest_q.put
+        backlog = _ingest_q.qsize
+        max_backlog = INGEST_QUEUE_MAX_SIZE
+        sample_rate = self.ERROR_LOG_SAMPLE_RATE
+        wall_time = time.time
+        monotonic = time.monotonic
         
-        try:
-            current_time = dj_timezone.now()
+        def on_message(client, userdata, msg):
+            # Plain floats here, datetimes are only built off this thread
+            received_at = wall_time()
+            now_m = monotonic()
             
-            with self._lock:
-                self.message_count += 1
-                self.last_message_time = current_time
-                
-                # Update metrics
-                self._message_times.append(current_time)
-                cutoff_time = current_time - timedelta(seconds=self.MESSAGE_RATE_WINDOW)
-                self._message_times = [
-                    t for t in self._message_times[-self.MAX_MESSAGE_TIMES_STORED:]
-                    if t > cutoff_time
-                ]
-                self.messages_per_minute = len(self._message_times)
+            node.message_count = count()
+            node.last_message_time = received_at
+            append_time(now_m)
             
-            try:
-                payload = json.loads(msg.payload.decode())
-            except json.JSONDecodeError as e:
-                logger.error(f"Node {self.node_id} received invalid JSON: {e}")
-                with self._lock:
-                    self.error_count += 1
+            if backlog() >= max_backlog:
+                dropped = next(_ingest_dropped)
+                if dropped % sample_rate == 1:
+                    logger.warning(
+                        "Ingest queue full (%d messages), dropped %d messages so far",
+                        max_backlog, dropped
+                    )
                 return
             
+            ingest((node, msg.topic, msg.payload, received_at, now_m))
+        
+        return on_message
+    
+    def _process_message(self, topic: str, payload_bytes: bytes, received_at: float, now_m: float):
+        """Batch and broadcast a received message (runs on an ingest worker, which never touches the ORM)"""
+        try:
             # --- 1. DB Batching Logic ---
+            # The raw payload is forwarded as-is, the Celery task parses it once.
             message_data = {
                 'node_id': self.node_id,
-                'topic': msg.topic,
-                'payload': payload,
-                'timestamp': current_time.isoformat()
+                'topic': topic,
+                # Raw bytes travel as msgpack bin, no text encoding needed
+                'payload_raw': payload_bytes,
+                # Epoch seconds, ISO strings are only built for WebSocket consumers
+                'timestamp': received_at,
             }
             
-            should_flush = False
-            with self._lock:
-                self._message_buffer.append(message_data)
-                
-                # Check flush conditions (Size OR Time)
-                time_since_flush = (current_time - self._last_batch_flush).total_seconds()
-                if (len(self._message_buffer) >= self.BATCH_SIZE or
-                        time_since_flush >= self.BATCH_TIMEOUT):
-                    should_flush = True
+            # deque appends are atomic, no lock needed
+            self._message_buffer.append(message_data)
             
-            if should_flush:
+            # Size-based flush only, the batch flusher thread handles
+            # BATCH_TIMEOUT. Don't leave messages behind once stopped.
+            if len(self._message_buffer) >= self.BATCH_SIZE or self._stop_event.is_set():
                 self._flush_buffer()
             
-            # --- 2. WebSocket Throttling Logic ---
-            # Only broadcast if enough time has passed since the last broadcast
-            time_since_broadcast = (current_time - self._last_ws_broadcast).total_seconds()
-            
-            if time_since_broadcast >= self.WS_BROADCAST_MIN_INTERVAL:
-                self._broadcast_message(msg.topic, payload)
-                with self._lock:
-                    self._last_ws_broadcast = current_time
+            # --- 2. WebSocket Broadcast ---
+            # Messages are queued and coalesced by the broadcast loop
+            if _has_subscribers():
+                # Only decode when someone is actually listening
+                try:
+                    payload = orjson.loads(payload_bytes)
+                except orjson.JSONDecodeError as e:
+                    with self._counter_lock:
+                        self.error_count += 1
+                        error_count = self.error_count
+                    # A misbehaving publisher can send these at message rate
+                    if error_count % self.ERROR_LOG_SAMPLE_RATE == 1:
+                        logger.error(
+                            "Node %s received invalid JSON (error #%d, logging every %d): %s",
+                            self.node_id, error_count, self.ERROR_LOG_SAMPLE_RATE, e
+                        )
+                    return
+                
+                # Consumers only show where the observation is, so the rest
+                # of the notification isn't carried over the channel layer
+                geometry = payload.get('geometry') if isinstance(payload, dict) else None
+                timestamp = datetime.fromtimestamp(received_at, tz=timezone.utc).isoformat()
+                self._broadcast_message(topic, geometry, timestamp)
             
             # --- 3. Status Update Throttling ---
             # Periodic status updates (Message count, uptime, etc.)
-            if (current_time - self._last_status_update).total_seconds() > self.STATUS_UPDATE_INTERVAL:
+            # Only ingest workers touch the throttle timestamp, claiming the
+            # slot before building the status keeps them from both firing
+            if now_m - self._last_status_update_mono > self.STATUS_UPDATE_INTERVAL:
+                self._last_status_update_mono = now_m
                 self._update_status()
-                with self._lock:
-                    self._last_status_update = current_time
         
         except Exception as e:
             logger.error(
-                f"Error processing message for node {self.node_id}: {e}",
+                "Error processing message for node %s: %s", self.node_id, e,
                 exc_info=True
             )
-            with self._lock:
+            with self._counter_lock:
                 self.error_count += 1
     
-    def _update_status(self):
-        """Update node status in cache"""
-        cache_key = f"mqtt_node_{self.node_id}_status"
-        
+    def _refresh_message_rate(self):
+        """Drop receive times that fell out of the rate window and update the rate (call with the lock held)"""
+        # Timestamps are appended in order, so only expired entries at
+        # the left end need to be dropped
+        message_times = self._message_times
+        cutoff = time.monotonic() - self.MESSAGE_RATE_WINDOW
+        while message_times and message_times[0] < cutoff:
+            message_times.popleft()
+        self.messages_per_minute = len(message_times)
+    
+    def _refresh_status_template(self):
+        """Update the transition-only status fields (call with the lock held)"""
+        self._status.update({
+            'state': self.state.value,
+            'previous_state': self.previous_state.value if self.previous_state else None,
+            'is_connected': self.state == ClientState.CONNECTED,
+            'state_changed_at': self.state_changed_at.isoformat(),
+            'connected_at': self.connected_at.isoformat() if self.connected_at else None,
+            'disconnected_at': self.disconnected_at.isoformat() if self.disconnected_at else None,
+            'last_error': self.last_error,
+        })
+    
+    def _build_status_dict(self) -> dict:
+        """Build the status payload stored in cache for this node"""
         with self._lock:
-            time_in_state = (dj_timezone.now() - self.state_changed_at).total_seconds()
-            uptime_seconds = None
-            if self.is_connected and self.connected_at:
-                uptime_seconds = (dj_timezone.now() - self.connected_at).total_seconds()
-            
-            status_data = {
-                'node_id': self.node_id,
-                'node_name': self.node.name,
-                'state': self.state.value,
-                'previous_state': self.previous_state.value if self.previous_state else None,
-                'is_connected': self.state == ClientState.CONNECTED,
-                'time_in_state_seconds': time_in_state,
-                'state_changed_at': self.state_changed_at.isoformat(),
-                'broker_host': self.broker_host,
-                'broker_port': self.broker_port,
-                'subscribed_topics': self.topics,
-                'subscription_count': len(self.topics),
-                'connection_attempts': self.connection_attempts,
-                'successful_connections': self.successful_connections,
-                'failed_connections': self.failed_connections,
-                'connected_at': self.connected_at.isoformat() if self.connected_at else None,
-                'disconnected_at': self.disconnected_at.isoformat() if self.disconnected_at else None,
-                'uptime_seconds': uptime_seconds,
-                'message_count': self.message_count,
-                'messages_per_minute': round(self.messages_per_minute, 2),
-                'last_message_time': self.last_message_time.isoformat() if self.last_message_time else None,
-                'error_count': self.error_count,
-                'last_error': self.last_error,
-                'last_update': dj_timezone.now().isoformat(),
-            }
+            return self._status_snapshot()
+    
+    def _status_snapshot(self) -> dict:
+        """Build the status payload (call with the lock held)"""
+        self._refresh_message_rate()
+        now = dj_timezone.now()
+        uptime_seconds = None
+        if self.is_connected and self.connected_at:
+            uptime_seconds = (now - self.connected_at).total_seconds()
         
-        try:
-            cache.set(cache_key, status_data, timeout=None)
-        except Exception as e:
-            logger.error(f"Failed to update cache for node {self.node_id}: {e}")
+        # Copy, since the cache writer pickles it from another thread
+        status_data = self._status.copy()
+        status_data.update({
+            'time_in_state_seconds': (now - self.state_changed_at).total_seconds(),
+            'connection_attempts': self.connection_attempts,
+            'successful_connections': self.successful_connections,
+            'failed_connections': self.failed_connections,
+            'uptime_seconds': uptime_seconds,
+            'message_count': self.message_count,
+            'messages_per_minute': round(self.messages_per_minute, 2),
+            'last_message_time': (
+                datetime.fromtimestamp(self.last_message_time, tz=timezone.utc).isoformat()
+                if self.last_message_time else None
+            ),
+            'error_count': self.error_count,
+            'last_update': now.isoformat(),
+        })
+        
+        return status_data
+    
+    def _update_status(self) -> dict:
+        """Queue a node status update for the next status writer tick"""
+        with self._lock:
+            return self._queue_status(self._status_snapshot())
+    
+    def _queue_status(self, status_data: dict) -> dict:
+        self._last_status = status_data
+        with _pending_status_lock:
+            _pending_status[self._cache_key] = status_data
+        return status_data
     
     def _broadcast_status(self):
         """Broadcast status update via WebSocket"""
+        if not _has_subscribers():
+            return
+        
         try:
-            channel_layer = get_channel_layer()
-            if channel_layer:
-                with self._lock:
-                    status_payload = {
-                        'node_id': self.node_id,
-                        'node_name': self.node.name,
-                        'state': self.state.value,
-                        'is_connected': self.is_connected,
-                        'message_count': self.message_count,
-                        'messages_per_minute': round(self.messages_per_minute, 2),
-                        'timestamp': dj_timezone.now().isoformat()
-                    }
+            channel_layer = self._channel_layer
+            status_data = self._last_status
+            if channel_layer and status_data:
+                # Sliced from the status just written to cache, no state is re-read
+                status_payload = {field: status_data[field] for field in self._WS_FIELDS}
+                status_payload['timestamp'] = status_data['last_update']
                 
-                async_to_sync(channel_layer.group_send)(
-                    "mqtt_status",
-                    {
-                        'type': 'status_update',
-                        'status': status_payload
-                    }
-                )
+                # Make sure the loop that sends pending statuses is running
+                _get_broadcast_loop()
+                with _pending_ws_statuses_lock:
+                    _pending_ws_statuses[self.node_id] = status_payload
         except Exception as e:
-            logger.error(f"Failed to broadcast status for node {self.node_id}: {e}")
+            logger.error("Failed to broadcast status for node %s: %s", self.node_id, e)
     
-    def _broadcast_message(self, topic: str, payload: dict):
-        """Broadcast received message via WebSocket"""
+    def _broadcast_message(self, topic: str, geometry: dict | None, timestamp: str):
+        """
+        Queue a received message for the next coalesced WebSocket broadcast.
+        Callers check _has_subscribers() first. Only the fields consumers
+        forward to the browser are sent.
+        """
         try:
-            channel_layer = get_channel_layer()
-            if channel_layer:
-                with self._lock:
-                    message_payload = {
-                        'node_id': self.node_id,
-                        'node_name': self.node.name,
-                        'payload': payload,
-                        'topic': topic,
-                        'message_count': self.message_count,
-                        'timestamp': dj_timezone.now().isoformat()
-                    }
+            if self._channel_layer:
+                # Make sure the loop that drains the queue is running
+                _get_broadcast_loop()
                 
-                async_to_sync(channel_layer.group_send)(
-                    "mqtt_status",
-                    {
-                        'type': 'message_received',
-                        **message_payload
-                    }
-                )
+                # Positional, no dict per message and no repeated keys on the wire
+                _pending_ws_messages.append((self.node_id, topic, geometry, timestamp))
         except Exception as e:
-            logger.error(f"Failed to broadcast message for node {self.node_id}: {e}")
+            logger.error("Failed to broadcast message for node %s: %s", self.node_id, e)
     
     def connect(self):
         """Connect to MQTT broker asynchronously"""
         try:
-            self._change_state(ClientState.CONNECTING)
+            now = dj_timezone.now()
+            self._change_state(ClientState.CONNECTING, now=now)
             
             with self._lock:
                 self.connection_attempts += 1
-                self.last_connection_attempt = dj_timezone.now()
+                self.last_connection_attempt = now
                 attempt_num = self.connection_attempts
             
             logger.info(
-                f"Async connection initiated for node {self.node_id} ({self.node.name}) "
-                f"to {self.broker_host}:{self.broker_port} "
-                f"(attempt #{attempt_num})"
+                "Async connection initiated for node %s (%s) to %s:%s (attempt #%d)",
+                self.node_id, self.node_name, self.broker_host, self.broker_port, attempt_num
             )
             
-            # Switch to connect_async to prevent blocking the Celery worker
-            # Paho will handle the handshake in the background loop
-            self.client.connect_async(self.broker_host, self.broker_port, keepalive=60)
-            
-            # We start the background loop immediately
-            self.client.loop_start()
+            # Join (or open) the shared connection for this broker
+            self._connection = MQTTBrokerConnection.attach(self)
             
             return True
         
         except ValueError as e:
             # Paho raises ValueError for invalid port numbers, etc.
             error_msg = f"Configuration error: {str(e)}"
-            logger.error(f"Node {self.node_id}: {error_msg}")
+            logger.error("Node %s: %s", self.node_id, error_msg)
             with self._lock:
                 self.failed_connections += 1
             self._change_state(ClientState.ERROR, error_msg)
@@ -433,17 +1124,44 @@ class MQTTNodeClient:
         except Exception as e:
             # Catch-all for other immediate errors (e.g., DNS resolution failure in some Paho versions)
             error_msg = f"Failed to initiate connection: {str(e)}"
-            logger.error(f"Node {self.node_id}: {error_msg}", exc_info=True)
+            logger.error("Node %s: %s", self.node_id, error_msg, exc_info=True)
             with self._lock:
                 self.failed_connections += 1
             self._change_state(ClientState.ERROR, error_msg)
             return False
     
+    def reconnect(self) -> bool:
+        """
+        Recover over the existing broker connection instead of building a new
+        client. Returns False if the client was stopped and has to be recreated.
+        """
+        connection = self._connection
+        if connection is None or self._stop_event.is_set():
+            return False
+        
+        if connection.is_connected:
+            logger.info("Node %s (%s) broker connection is up, re-subscribing", self.node_id, self.node_name)
+            connection._subscribe(self.topics)
+            if not self.is_connected:
+                self._on_connect(connection.client, None, None, 0)
+            return True
+        
+        now = dj_timezone.now()
+        self._change_state(ClientState.CONNECTING, now=now)
+        with self._lock:
+            self.connection_attempts += 1
+            self.last_connection_attempt = now
+        
+        logger.info("Reconnecting node %s (%s) to %s:%s", self.node_id, self.node_name,
+                    self.broker_host, self.broker_port)
+        connection.reconnect()
+        return True
+    
     def disconnect(self):
         """Disconnect from MQTT broker"""
-        logger.info(f"Disconnecting node {self.node_id} ({self.node.name})")
+        logger.info("Disconnecting node %s (%s)", self.node_id, self.node_name)
         
-        # Stop the refresh thread
+        # Mark the client stopped
         self._stop_event.set()
         
         # Flush remaining messages before stopping
@@ -452,9 +1170,9 @@ class MQTTNodeClient:
         self._change_state(ClientState.STOPPING)
         
         try:
-            if self.client:
-                self.client.loop_stop()
-                self.client.disconnect()
+            if self._connection:
+                self._connection.detach(self)
+                self._connection = None
             
             with self._lock:
                 self.is_connected = False
@@ -463,47 +1181,31 @@ class MQTTNodeClient:
             self._change_state(ClientState.DISCONNECTED)
         
         except Exception as e:
-            logger.error(f"Error during disconnect for node {self.node_id}: {e}")
+            logger.error("Error during disconnect for node %s: %s", self.node_id, e)
             self._change_state(ClientState.DISCONNECTED)
     
-    def get_stats(self) -> dict:
+    def get_stats(self) -> ClientStats:
         """Get current statistics for this client"""
         with self._lock:
+            self._refresh_message_rate()
             uptime_seconds = None
             if self.is_connected and self.connected_at:
                 uptime_seconds = (dj_timezone.now() - self.connected_at).total_seconds()
             
-            return {
-                'node_id': self.node_id,
-                'node_name': self.node.name,
-                'state': self.state.value,
-                'is_connected': self.is_connected,
-                'uptime_seconds': uptime_seconds,
-                'message_count': self.message_count,
-                'messages_per_minute': round(self.messages_per_minute, 2),
-                'connection_attempts': self.connection_attempts,
-                'successful_connections': self.successful_connections,
-                'failed_connections': self.failed_connections,
-                'error_count': self.error_count,
-                'last_error': self.last_error,
-            }
-    
-    def _lock_refresh_loop(self):
-        """Background thread to keep the Redis lock alive while connected"""
-        from wis2watch.mqtt.service import mqtt_monitoring_service
-        
-        logger.debug(f"Starting lock refresh loop for node {self.node_id}")
-        while not self._stop_event.is_set():
-            if self.is_connected:
-                try:
-                    # Call the service method to update Redis
-                    # We access the protected method _refresh_lock directly for efficiency
-                    mqtt_monitoring_service._refresh_lock(self.node_id)
-                except Exception as e:
-                    logger.error(f"Error refreshing lock for node {self.node_id}: {e}")
-            
-            # Refresh every 30 seconds (well within the service's LOCK_TIMEOUT timeout)
-            self._stop_event.wait(30)
+            return ClientStats(
+                node_id=self.node_id,
+                node_name=self.node_name,
+                state=self.state.value,
+                is_connected=self.is_connected,
+                uptime_seconds=uptime_seconds,
+                message_count=self.message_count,
+                messages_per_minute=round(self.messages_per_minute, 2),
+                connection_attempts=self.connection_attempts,
+                successful_connections=self.successful_connections,
+                failed_connections=self.failed_connections,
+                error_count=self.error_count,
+                last_error=self.last_error,
+            )
     
     def is_healthy(self) -> bool:
         """Check if the client is in a healthy state"""
@@ -520,23 +1222,14 @@ class MQTTNodeClient:
     
     @staticmethod
     def _get_connection_error_message(rc: int) -> str:
-        error_messages = {
-            1: "Connection refused - incorrect protocol version",
-            2: "Connection refused - invalid client identifier",
-            3: "Connection refused - server unavailable",
-            4: "Connection refused - bad username or password",
-            5: "Connection refused - not authorized",
-        }
-        return error_messages.get(rc, f"Connection failed with code {rc}")
+        # MQTTv5 passes a ReasonCode, which can't be used as an index
+        rc = getattr(rc, 'value', rc)
+        message = _CONNECT_ERRORS[rc] if 0 < rc < len(_CONNECT_ERRORS) else None
+        return message or f"Connection failed with code {rc}"
     
     @staticmethod
     def _get_disconnect_error_message(rc: int) -> str:
-        error_messages = {
-            1: "Disconnected - unacceptable protocol version",
-            2: "Disconnected - identifier rejected",
-            3: "Disconnected - server unavailable",
-            4: "Disconnected - bad authentication",
-            5: "Disconnected - not authorized",
-            7: "Disconnected - no matching subscribers",
-        }
-        return error_messages.get(rc, f"Disconnected with code {rc}")
+        # MQTTv5 passes a ReasonCode, which can't be used as an index
+        rc = getattr(rc, 'value', rc)
+        message = _DISCONNECT_ERRORS[rc] if 0 < rc < len(_DISCONNECT_ERRORS) else None
+        return message or f"Disconnected with code {rc}"
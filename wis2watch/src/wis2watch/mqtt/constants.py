@@ -0,0 +1,10 @@
+# Cache keys shared with core and management commands, kept apart from
+# tasks.py so that importing them doesn't load the MQTT service
+
+# Written by the beat_heartbeat task, read by the beat_healthcheck command
+BEAT_HEARTBEAT_KEY = "mqtt_beat_heartbeat"
+BEAT_HEARTBEAT_TTL = 120  # seconds, two missed runs of the 60 second schedule
+
+# Changed when Stations or Datasets are synced or deleted. Worker processes
+# drop their cached primary keys when they see a new value
+PK_CACHE_GENERATION_KEY = "mqtt_pk_cache_generation"
@@ -1,14 +1,43 @@
 import logging
+import random
 import threading
+import time
 import uuid
+from dataclasses import asdict
+from enum import Enum
 from typing import Dict, Optional
 
+from django.conf import settings
 from django.core.cache import cache
+from django.db import transaction
 from django.utils import timezone as dj_timezone
+from django_redis import get_redis_connection
+
+from ..core.models import WIS2Node
+from .client import MQTTNodeClient
 
 logger = logging.getLogger(__name__)
 
-from .client import MQTTNodeClient
+# Extend a lock's TTL only if it still holds the exact value this instance
+# wrote. Lock values are pickled, so ownership is checked on the raw bytes.
+REFRESH_LOCK_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('pexpire', KEYS[1], ARGV[2])
+end
+return 0
+"""
+
+
+class StartResult(Enum):
+    """Outcome of MQTTMonitoringService.start_node"""
+    STARTED = "started"
+    NOT_FOUND = "not_found"
+    ALREADY_STARTING = "already_starting"  # another start of the node is running in this process
+    BACKING_OFF = "backing_off"  # the node failed recently and its backoff has not elapsed
+    BUSY = "busy"  # another worker holds the node row while starting it
+    LOCKED = "locked"  # another worker holds the node's monitoring lock
+    CONNECT_FAILED = "connect_failed"  # the client could not connect to the broker
+    ERROR = "error"  # unexpected error, already logged
 
 
 class MQTTMonitoringService:
@@ -16,126 +45,288 @@ class MQTTMonitoringService:
     
     # Lock timeouts
     LOCK_TIMEOUT = 120  # 2 minutes
-    LOCK_REFRESH_INTERVAL = 240  # 4 minutes
+    LOCK_REFRESH_INTERVAL = 30  # seconds, well within LOCK_TIMEOUT
+    
+    # Restart backoff for nodes that keep ending up unhealthy
+    BACKOFF_BASE = 2.0
+    BACKOFF_MAX = 300  # 5 minutes
+    BACKOFF_JITTER = 5  # seconds
+    
+    # Number of per-node lock shards, a power of two
+    LOCK_SHARDS = 16
     
     def __init__(self):
         self.clients: Dict[int, MQTTNodeClient] = {}
-        self._lock = threading.RLock()
+        # Starting/stopping a node only serializes with nodes in the same shard.
+        # Readers take a snapshot of self.clients instead of locking
+        self._shard_locks = [threading.RLock() for _ in range(self.LOCK_SHARDS)]
+        # Nodes with a start in progress in this process
+        self._starting = set()
+        self._starting_lock = threading.Lock()
+        # The Redis lock is only needed when several worker processes may
+        # try to monitor the same node
+        self.multi_process = getattr(settings, 'WIS2WATCH_MQTT_MULTI_PROCESS', True)
+        # Encoded value of each lock this instance wrote, for owner-checked refreshes
+        self._lock_tokens = {}
+        self._refresh_script = None
+        # Single thread refreshing the locks of all clients in this process
+        self._refresh_thread = None
+        self._refresh_thread_lock = threading.Lock()
         # Generate a unique ID for this specific running process
         self.instance_id = str(uuid.uuid4())
         logger.info(f"MQTT Service initialized with Instance ID: {self.instance_id}")
     
+    def _shard(self, node_id: int) -> threading.RLock:
+        """Get the in-process lock guarding a node's client"""
+        return self._shard_locks[node_id & (self.LOCK_SHARDS - 1)]
+    
     def _get_lock_key(self, node_id: int) -> str:
         """Get cache key for node lock"""
         return f"mqtt_node_{node_id}_lock"
     
+    def _set_lock_token(self, node_id: int, lock_data: dict):
+        """Remember the encoded value written for a node's lock"""
+        self._lock_tokens[node_id] = cache.client.encode(lock_data)
+    
+    def _get_refresh_script(self):
+        if self._refresh_script is None:
+            self._refresh_script = get_redis_connection("default").register_script(REFRESH_LOCK_SCRIPT)
+        return self._refresh_script
+    
     def _acquire_lock(self, node_id: int) -> bool:
         """
         Attempt to acquire a lock for a node.
         Respects existing locks from other workers.
         """
-        lock_key = self._get_lock_key(node_id)
-        current_lock = cache.get(lock_key)
-        
-        if current_lock:
-            owner = current_lock.get('owner')
-            if owner == self.instance_id:
-                # Re-entrant: We already own it, success
-                return True
-            else:
-                # LOCKED BY SOMEONE ELSE: Do not touch it.
-                logger.warning(f"Node {node_id} is locked by active worker {owner}. Skipping start.")
-                return False
+        if not self.multi_process:
+            return True
         
-        # Lock is free, take it
+        lock_key = self._get_lock_key(node_id)
+        now = dj_timezone.now()
         lock_data = {
-            'acquired_at': dj_timezone.now().isoformat(),
+            'acquired_at': now.isoformat(),
             'node_id': node_id,
             'owner': self.instance_id
         }
         
-        return cache.add(lock_key, lock_data, timeout=self.LOCK_TIMEOUT)
+        # Atomic (SETNX) so two workers can't both take a free lock
+        if cache.add(lock_key, lock_data, timeout=self.LOCK_TIMEOUT):
+            self._set_lock_token(node_id, lock_data)
+            return True
+        
+        current_lock = cache.get(lock_key)
+        if not current_lock:
+            # Expired between the two calls, try once more
+            if cache.add(lock_key, lock_data, timeout=self.LOCK_TIMEOUT):
+                self._set_lock_token(node_id, lock_data)
+                return True
+            return False
+        
+        owner = current_lock.get('owner')
+        if owner == self.instance_id:
+            # Re-entrant: We already own it, success
+            return True
+        
+        # Live locks always carry a TTL. One without expiry would never be
+        # released by a dead owner: break it
+        if cache.ttl(lock_key) is None:
+            logger.warning(f"Breaking zombie lock on node {node_id} held by {owner} (no expiry)")
+            cache.set(lock_key, lock_data, timeout=self.LOCK_TIMEOUT)
+            self._set_lock_token(node_id, lock_data)
+            return True
+        
+        # LOCKED BY SOMEONE ELSE: Do not touch it.
+        logger.warning(f"Node {node_id} is locked by active worker {owner}. Skipping start.")
+        return False
     
     def _release_lock(self, node_id: int):
         """Release the lock for a node"""
+        if not self.multi_process:
+            return
+        
         lock_key = self._get_lock_key(node_id)
+        self._lock_tokens.pop(node_id, None)
         cache.delete(lock_key)
     
-    def _refresh_lock(self, node_id: int):
-        """Refresh the lock for a node to extend its timeout"""
+    def _rewrite_lock(self, node_id: int):
+        """Write this instance's lock for a node, keeping the original acquisition time"""
         lock_key = self._get_lock_key(node_id)
         
         # Preserve the original acquisition time if possible, but update refresh time
+        now = dj_timezone.now().isoformat()
         current_lock = cache.get(lock_key) or {}
-        acquired_at = current_lock.get('acquired_at', dj_timezone.now().isoformat())
+        acquired_at = current_lock.get('acquired_at', now)
         
         lock_data = {
             'acquired_at': acquired_at,
             'node_id': node_id,
             'owner': self.instance_id,
-            'refreshed_at': dj_timezone.now().isoformat()
+            'refreshed_at': now
         }
         cache.set(lock_key, lock_data, timeout=self.LOCK_TIMEOUT)
+        self._set_lock_token(node_id, lock_data)
+    
+    def refresh_all_locks(self):
+        """Extend the locks of all connected clients in one pipelined round trip"""
+        if not self.multi_process:
+            return
+        
+        node_ids = [node_id for node_id, client in list(self.clients.items()) if client.is_connected]
+        to_rewrite = [node_id for node_id in node_ids if node_id not in self._lock_tokens]
+        tokens = [(node_id, self._lock_tokens[node_id]) for node_id in node_ids if node_id in self._lock_tokens]
+        
+        if tokens:
+            script = self._get_refresh_script()
+            pipe = get_redis_connection("default").pipeline(transaction=False)
+            for node_id, token in tokens:
+                script(keys=[cache.make_key(self._get_lock_key(node_id))],
+                       args=[token, self.LOCK_TIMEOUT * 1000], client=pipe)
+            
+            for (node_id, _), refreshed in zip(tokens, pipe.execute()):
+                if not refreshed:
+                    logger.warning(f"Lock on node {node_id} expired or changed hands, rewriting it")
+                    to_rewrite.append(node_id)
+        
+        for node_id in to_rewrite:
+            self._rewrite_lock(node_id)
+    
+    def _ensure_refresh_thread(self):
+        """Start the lock refresh thread on first use"""
+        with self._refresh_thread_lock:
+            if self._refresh_thread is None:
+                self._refresh_thread = threading.Thread(
+                    target=self._lock_refresh_loop, name="wis2watch-lock-refresh", daemon=True
+                )
+                self._refresh_thread.start()
+    
+    def _lock_refresh_loop(self):
+        """Background thread keeping the Redis locks of connected clients alive"""
+        while True:
+            time.sleep(self.LOCK_REFRESH_INTERVAL)
+            try:
+                self.refresh_all_locks()
+            except Exception as e:
+                logger.error(f"Error refreshing node locks: {e}")
+    
+    def _get_backoff_key(self, node_id: int) -> str:
+        """Get cache key for node restart backoff"""
+        return f"mqtt_node_{node_id}_backoff"
+    
+    def _backoff_remaining(self, node_id: int) -> float:
+        """Seconds until the node may be started again, 0 if not backing off"""
+        backoff = cache.get(self._get_backoff_key(node_id))
+        if not backoff:
+            return 0
+        return max(0.0, backoff['next_attempt_at'] - time.time())
+    
+    def _record_failure(self, node_id: int):
+        """
+        Push back the next start of a failing node, with exponential backoff
+        plus jitter so that flapping brokers aren't hit by synchronized retries.
+        Kept in cache so every worker process sees it.
+        """
+        backoff_key = self._get_backoff_key(node_id)
+        failures = (cache.get(backoff_key) or {}).get('failures', 0) + 1
+        delay = min(self.BACKOFF_MAX, self.BACKOFF_BASE ** min(failures, 10)) + random.uniform(0, self.BACKOFF_JITTER)
+        
+        cache.set(backoff_key, {
+            'failures': failures,
+            'next_attempt_at': time.time() + delay,
+        }, timeout=None)
+        logger.info(f"Node {node_id} failed {failures} time(s), next start in {delay:.0f}s")
+    
+    def _reset_backoff(self, node_id: int):
+        """Forget previous failures of a node"""
+        cache.delete(self._get_backoff_key(node_id))
+    
+    def start_node(self, node_id: int) -> StartResult:
+        """Start monitoring a specific node, reporting why if it was not started"""
+        # Turn away concurrent starts of the same node in this process
+        # before any cache round trip
+        with self._starting_lock:
+            if node_id in self._starting:
+                logger.warning(f"Node {node_id} is already being started")
+                return StartResult.ALREADY_STARTING
+            self._starting.add(node_id)
+        
+        try:
+            return self._start_node(node_id)
+        finally:
+            with self._starting_lock:
+                self._starting.discard(node_id)
+    
+    def _start_node(self, node_id: int) -> StartResult:
+        remaining = self._backoff_remaining(node_id)
+        if remaining:
+            logger.warning(f"Node {node_id} is backing off after failures, not starting for {remaining:.0f}s")
+            return StartResult.BACKING_OFF
+        
+        try:
+            # The node row stays locked until the client is started. Workers
+            # racing to start the same node skip it rather than wait.
+            with transaction.atomic():
+                node = WIS2Node.objects.select_for_update(skip_locked=True).filter(id=node_id).first()
+                if node is None:
+                    if WIS2Node.objects.filter(id=node_id).exists():
+                        logger.warning(f"Node {node_id} is being started by another worker")
+                        return StartResult.BUSY
+                    logger.error(f"Node {node_id} not found in database")
+                    return StartResult.NOT_FOUND
+                
+                return self._start_client(node)
+        except Exception as e:
+            logger.error(f"Error starting node {node_id}: {e}", exc_info=True)
+            return StartResult.ERROR
     
-    def start_node(self, node_id: int) -> bool:
-        """Start monitoring a specific node"""
+    def _start_client(self, node) -> StartResult:
+        """Create and connect the client of a node, holding its Redis lock"""
+        node_id = node.id
+        
         # Check if already running
         if not self._acquire_lock(node_id):
             logger.warning(f"Node {node_id} is already being monitored")
-            return False
+            return StartResult.LOCKED
         
         try:
-            # Get node configuration from database
-            from wis2watch.core.models import WIS2Node
-            
-            try:
-                node = WIS2Node.objects.get(id=node_id)
-            except WIS2Node.DoesNotExist:
-                logger.error(f"Node {node_id} not found in database")
-                self._release_lock(node_id)
-                return False
-            
             # Thread-safe client management
-            with self._lock:
+            with self._shard(node_id):
                 # Stop existing client if any
                 if node_id in self.clients:
                     logger.info(f"Stopping existing client for node {node_id}")
                     self._stop_node_internal(node_id)
                 
                 # Create new client
-                try:
-                    client = MQTTNodeClient(
-                        node_id=node_id,
-                        broker_host=node.mqtt_host,
-                        broker_port=node.mqtt_port,
-                        username=node.mqtt_username,
-                        password=node.mqtt_password,
-                        topics=node.get_topics()
-                    )
-                except ValueError as e:
-                    logger.error(f"Failed to create client for node {node_id}: {e}")
-                    self._release_lock(node_id)
-                    return False
+                client = MQTTNodeClient(
+                    node_id=node_id,
+                    node_name=node.name,
+                    broker_host=node.mqtt_host,
+                    broker_port=node.mqtt_port,
+                    username=node.mqtt_username,
+                    password=node.mqtt_password,
+                    topics=node.get_cached_topics()
+                )
                 
                 # Attempt connection
                 if client.connect():
                     self.clients[node_id] = client
+                    if self.multi_process:
+                        self._ensure_refresh_thread()
                     logger.info(f"Successfully started monitoring node {node_id}")
-                    return True
+                    return StartResult.STARTED
                 else:
                     logger.error(f"Failed to connect client for node {node_id}")
                     self._release_lock(node_id)
-                    return False
+                    return StartResult.CONNECT_FAILED
         
         except Exception as e:
             logger.error(f"Error starting node {node_id}: {e}", exc_info=True)
             self._release_lock(node_id)
-            return False
+            return StartResult.ERROR
     
     def _stop_node_internal(self, node_id: int):
         """
         Internal method to stop a node without acquiring locks.
-        Should only be called when self._lock is already held.
+        Should only be called when the node's shard lock is already held.
         """
         if node_id in self.clients:
             try:
@@ -148,7 +339,7 @@ class MQTTMonitoringService:
     
     def stop_node(self, node_id: int) -> bool:
         """Stop monitoring a specific node"""
-        with self._lock:
+        with self._shard(node_id):
             if node_id not in self.clients:
                 logger.warning(f"No client found for node {node_id}")
                 self._release_lock(node_id)
@@ -161,40 +352,89 @@ class MQTTMonitoringService:
     def restart_node(self, node_id: int) -> bool:
         """Restart monitoring for a specific node"""
         logger.info(f"Restarting monitoring for node {node_id}")
+        # An explicit restart skips any pending backoff
+        self._reset_backoff(node_id)
+        if self._reconnect_node(node_id):
+            return True
         self.stop_node(node_id)
-        return self.start_node(node_id)
+        return self.start_node(node_id) is StartResult.STARTED
+    
+    def _reconnect_node(self, node_id: int) -> bool:
+        """
+        Reuse the running client of a node if its configuration is unchanged,
+        reconnecting it rather than tearing it down. Returns False if the
+        client has to be recreated.
+        """
+        client = self.get_client(node_id)
+        if client is None:
+            return False
+        
+        try:
+            node = WIS2Node.objects.get(id=node_id)
+        except WIS2Node.DoesNotExist:
+            return False
+        
+        config = (node.name, node.mqtt_host, node.mqtt_port, node.mqtt_username, node.mqtt_password,
+                  list(node.get_cached_topics()))
+        
+        with self._shard(node_id):
+            if self.clients.get(node_id) is not client:
+                return False
+            
+            if config != (client.node_name, client.broker_host, client.broker_port, client.username,
+                          client.password, list(client.topics)):
+                logger.info(f"Configuration of node {node_id} changed, recreating its client")
+                return False
+            
+            try:
+                return client.reconnect()
+            except Exception as e:
+                logger.error(f"Error reconnecting node {node_id}: {e}")
+                return False
     
     def get_client(self, node_id: int) -> Optional[MQTTNodeClient]:
         """Get client for a specific node (thread-safe)"""
-        with self._lock:
-            return self.clients.get(node_id)
+        # A single dict lookup is atomic, no lock needed
+        return self.clients.get(node_id)
     
     def get_all_node_ids(self) -> list:
-        """Get list of all monitored node IDs (thread-safe)"""
-        with self._lock:
-            return list(self.clients.keys())
+        """
+        Get list of all monitored node IDs (thread-safe).
+        The snapshot is taken without locking and may include a node that is
+        being stopped concurrently, get_client() then returns None for it.
+        """
+        return list(self.clients)
     
     def get_status(self) -> dict:
         """Get status of all monitored nodes"""
-        status = {}
+        # list() copies the items atomically, so no lock is needed for the snapshot
+        cache_keys = {client._cache_key: node_id for node_id, client in list(self.clients.items())}
         
-        # Get snapshot of node IDs to avoid holding lock during cache operations
-        with self._lock:
-            node_ids = list(self.clients.keys())
+        if not cache_keys:
+            return {}
         
-        for node_id in node_ids:
-            cache_key = f"mqtt_node_{node_id}_status"
-            node_status = cache.get(cache_key)
-            if node_status:
-                status[node_id] = node_status
+        # One round trip for all nodes
+        cached = cache.get_many(list(cache_keys))
+        return {cache_keys[key]: node_status for key, node_status in cached.items() if node_status}
+    
+    def update_all_statuses(self):
+        """Write the status of every monitored node to cache in a single round trip"""
+        clients = list(self.clients.values())
         
-        return status
+        if not clients:
+            return
+        
+        status_data = {client._cache_key: client._build_status_dict() for client in clients}
+        
+        try:
+            cache.set_many(status_data, timeout=None)
+        except Exception as e:
+            logger.error(f"Failed to update status cache for {len(clients)} nodes: {e}")
     
     def cleanup_stale_locks(self):
         """Remove locks and stop clients for nodes that are no longer healthy"""
         # Get snapshot to avoid concurrent modification issues
-        with self._lock:
-            node_ids = list(self.clients.keys())
+        node_ids = list(self.clients)
         
         for node_id in node_ids:
             try:
@@ -204,47 +444,75 @@ class MQTTMonitoringService:
                         f"Node {node_id} is unhealthy, stopping and cleaning up"
                     )
                     self.stop_node(node_id)
+                    self._record_failure(node_id)
+                elif client and client.is_connected:
+                    self._reset_backoff(node_id)
             except Exception as e:
                 logger.error(f"Error checking health for node {node_id}: {e}")
+        
+        try:
+            self.cleanup_orphaned_locks()
+        except Exception as e:
+            logger.error(f"Error cleaning up orphaned locks: {e}")
     
-    def get_health_report(self) -> dict:
-        """Get health report for all monitored nodes"""
-        report = {
-            'total_nodes': 0,
-            'healthy_nodes': 0,
-            'unhealthy_nodes': 0,
-            'nodes': {}
-        }
+    def cleanup_orphaned_locks(self) -> int:
+        """
+        Delete node locks that would otherwise never be released: locks without
+        an expiry, and locks this instance holds for nodes it no longer runs.
+        Returns the number of locks deleted.
+        """
+        if not self.multi_process:
+            return 0
         
-        with self._lock:
-            node_ids = list(self.clients.keys())
+        # SCAN rather than tracked clients, so locks of nodes never loaded here are seen too
+        lock_keys = list(cache.iter_keys(self._get_lock_key('*'), itersize=500))
+        if not lock_keys:
+            return 0
         
-        report['total_nodes'] = len(node_ids)
+        locks = cache.get_many(lock_keys)
+        pipe = get_redis_connection("default").pipeline(transaction=False)
+        for key in lock_keys:
+            pipe.ttl(cache.make_key(key))
+        ttls = dict(zip(lock_keys, pipe.execute()))
         
-        for node_id in node_ids:
-            client = self.get_client(node_id)
-            if client:
-                is_healthy = client.is_healthy()
-                stats = client.get_stats()
-                
-                report['nodes'][node_id] = {
-                    'healthy': is_healthy,
-                    'stats': stats
-                }
-                
-                if is_healthy:
-                    report['healthy_nodes'] += 1
-                else:
-                    report['unhealthy_nodes'] += 1
+        orphaned = {}
+        for key, lock in locks.items():
+            node_id = lock.get('node_id')
+            if ttls.get(key) == -1:
+                # No expiry
+                orphaned[key] = node_id
+            elif (lock.get('owner') == self.instance_id and node_id not in self.clients
+                  and node_id not in self._starting):
+                orphaned[key] = node_id
+        
+        if orphaned:
+            cache.delete_many(list(orphaned))
+            for node_id in orphaned.values():
+                self._lock_tokens.pop(node_id, None)
+            logger.warning(f"Deleted {len(orphaned)} orphaned node locks: {sorted(orphaned)}")
         
-        return report
+        return len(orphaned)
+    
+    def get_health_report(self) -> dict:
+        """
+        Get health report for all monitored nodes.
+        Stats are only collected for unhealthy nodes, listed under 'unhealthy'.
+        """
+        clients = list(self.clients.values())
+        unhealthy = [asdict(client.get_stats()) for client in clients if not client.is_healthy()]
+        
+        return {
+            'total_nodes': len(clients),
+            'healthy_nodes': len(clients) - len(unhealthy),
+            'unhealthy_nodes': len(unhealthy),
+            'unhealthy': unhealthy,
+        }
     
     def shutdown_all(self):
         """Shutdown all clients gracefully"""
         logger.info("Shutting down all MQTT clients")
         
-        with self._lock:
-            node_ids = list(self.clients.keys())
+        node_ids = list(self.clients)
         
         for node_id in node_ids:
             try:
@@ -1,22 +1,52 @@
+import base64
+import csv
+import io
 import logging
+import sys
+import threading
+import time
 from datetime import datetime, timezone
 
-from celery import shared_task
+import orjson
+import zstandard
+from celery import group, shared_task
 from django.core.cache import cache
-from django.db import transaction
+from django.db import connection, transaction
 from django.utils import timezone as dj_timezone
 
-from ..core.models import StationMQTTMessageLog, Station, Dataset
+from ..core.models import StationMQTTMessageLog, Station, Dataset, WIS2Node
 from ..core.sync import sync_metadata
+from .constants import BEAT_HEARTBEAT_KEY, BEAT_HEARTBEAT_TTL, PK_CACHE_GENERATION_KEY
 
 logger = logging.getLogger(__name__)
 
-from .service import mqtt_monitoring_service
+from .service import StartResult, mqtt_monitoring_service
 
 
-class NodeNotFoundError(Exception):
-    """Raised when a node is not found in the database"""
-    pass
+# Minimum seconds between metadata syncs triggered by unknown stations, per node
+SYNC_METADATA_THROTTLE = 300
+
+
+# Rows per INSERT statement when storing a message batch
+BULK_CREATE_BATCH_SIZE = 500
+
+# Batches larger than this, e.g. backlogs replayed after an outage, are
+# loaded with COPY instead of INSERT
+COPY_THRESHOLD = 200
+# StationMQTTMessageLog fields written by COPY, raw_json is left NULL
+COPY_FIELDS = (
+    'time', 'created', 'modified', 'station', 'dataset', 'message_id', 'data_id',
+    'publish_datetime', 'received_datetime', 'canonical_link', 'raw_message',
+)
+
+# Per worker process cache of Station/Dataset primary keys, which rarely change
+PK_CACHE_TTL = 300  # seconds
+PK_CACHE_MAX_SIZE = 10000
+
+# Circuit breaker for nodes whose broker keeps refusing connections
+CIRCUIT_FAILURE_THRESHOLD = 10  # consecutive start failures before the circuit opens
+CIRCUIT_FAILURE_TTL = 1800  # seconds, failures older than this are forgotten
+CIRCUIT_COOLDOWN = 900  # seconds the circuit stays open
 
 
 class ConnectionError(Exception):
@@ -24,6 +54,26 @@ class ConnectionError(Exception):
     pass
 
 
+def _get_failures_key(node_id: int) -> str:
+    return f"mqtt_node_{node_id}_start_failures"
+
+
+def _get_circuit_open_key(node_id: int) -> str:
+    return f"mqtt_node_{node_id}_circuit_open"
+
+
+def _record_start_failure(node_id: int) -> int:
+    """Count a failed start of a node, returning its consecutive failures"""
+    failures_key = _get_failures_key(node_id)
+    cache.add(failures_key, 0, timeout=CIRCUIT_FAILURE_TTL)
+    try:
+        return cache.incr(failures_key)
+    except ValueError:
+        # Expired between add and incr
+        cache.set(failures_key, 1, timeout=CIRCUIT_FAILURE_TTL)
+        return 1
+
+
 @shared_task(
     bind=True,
     max_retries=3,
@@ -36,40 +86,52 @@ def start_mqtt_monitoring(self, node_id: int):
     """
     Start MQTT monitoring for a node (Celery task)
     
-    Automatically retries on ConnectionError with exponential backoff.
-    Does not retry on NodeNotFoundError.
+    Automatically retries on ConnectionError with exponential backoff, raised
+    only when the client failed to connect to the broker. Missing nodes and
+    starts refused because the node is monitored or being started elsewhere,
+    or is backing off, are neither retried nor counted as failures.
+    After CIRCUIT_FAILURE_THRESHOLD consecutive failures, starts are skipped
+    for CIRCUIT_COOLDOWN seconds. The next beat run after that is the probe.
     """
+    if cache.get(_get_circuit_open_key(node_id)):
+        logger.info(f"Circuit open for node {node_id}, skipping start")
+        return False
+    
     try:
         result = mqtt_monitoring_service.start_node(node_id)
-        
-        if not result:
-            # Check if it's because node doesn't exist
-            from wis2watch.core.models import WIS2Node
-            try:
-                WIS2Node.objects.get(id=node_id)
-                # Node exists but connection failed
-                raise ConnectionError(f"Failed to start monitoring for node {node_id}")
-            except WIS2Node.DoesNotExist:
-                # Node doesn't exist - don't retry
-                raise NodeNotFoundError(f"Node {node_id} not found")
-        
+    except Exception as e:
+        logger.error(f"Unexpected error starting monitoring for node {node_id}: {e}", exc_info=True)
+        # Retry for other unexpected errors
+        raise self.retry(exc=e, countdown=60)
+    
+    if result is StartResult.STARTED:
         logger.info(f"Successfully started monitoring for node {node_id}")
-        return result
+        cache.delete_many([_get_failures_key(node_id), _get_circuit_open_key(node_id)])
+        return True
     
-    except NodeNotFoundError as e:
-        logger.error(f"Node {node_id} not found, won't retry: {e}")
+    if result is StartResult.NOT_FOUND:
         # Don't retry for missing nodes
+        logger.error(f"Node {node_id} not found, won't retry")
         return False
     
-    except ConnectionError as e:
-        logger.error(f"Connection failed for node {node_id}: {e}")
-        # This will be auto-retried due to autoretry_for
-        raise
+    if result is StartResult.ERROR:
+        # Already logged by the service, not a broker failure
+        raise self.retry(countdown=60)
     
-    except Exception as e:
-        logger.error(f"Unexpected error starting monitoring for node {node_id}: {e}", exc_info=True)
-        # Retry for other unexpected errors
-        raise self.retry(exc=e, countdown=60)
+    if result is not StartResult.CONNECT_FAILED:
+        logger.info(f"Not starting node {node_id}: {result.value}")
+        return False
+    
+    logger.error(f"Connection failed for node {node_id}")
+    if _record_start_failure(node_id) >= CIRCUIT_FAILURE_THRESHOLD:
+        cache.set(_get_circuit_open_key(node_id), True, timeout=CIRCUIT_COOLDOWN)
+        logger.warning(
+            f"Node {node_id} failed {CIRCUIT_FAILURE_THRESHOLD}+ times in a row, "
+            f"not retrying for {CIRCUIT_COOLDOWN}s"
+        )
+        return False
+    # This will be auto-retried due to autoretry_for
+    raise ConnectionError(f"Failed to start monitoring for node {node_id}")
 
 
 @shared_task(bind=True)
@@ -103,31 +165,34 @@ def monitor_all_active_nodes():
     Checks GLOBAL state (Redis Locks) to prevent duplicate tasks across workers.
     Run this every 5 minutes.
     """
-    from wis2watch.core.models import WIS2Node
-    
     logger.info("Checking all active nodes for monitoring status")
     
     try:
-        active_nodes = WIS2Node.objects.all()
-        logger.info(f"Found {active_nodes.count()} nodes")
+        node_ids = list(WIS2Node.objects.values_list('id', flat=True))
+        logger.info(f"Found {len(node_ids)} nodes")
         
-        started_count = 0
-        for node in active_nodes:
-            # Check Global Lock in Redis
-            # Make sure this key format matches _get_lock_key in service.py exactly!
-            lock_key = node.lock_key
-            
-            if cache.get(lock_key):
+        # Check Global Locks in Redis, one round trip for all nodes
+        lock_keys = {node_id: mqtt_monitoring_service._get_lock_key(node_id) for node_id in node_ids}
+        if mqtt_monitoring_service.multi_process:
+            locks = cache.get_many(list(lock_keys.values()))
+        else:
+            # Single worker process (enforced at worker startup), no Redis locks are taken
+            locks = {lock_keys[node_id]: True for node_id in node_ids if mqtt_monitoring_service.get_client(node_id)}
+        
+        to_start = []
+        for node_id in node_ids:
+            if locks.get(lock_keys[node_id]):
                 # Lock exists -> Someone is already monitoring this. Do nothing.
                 continue
             
             # No lock -> Node is truly unmonitored. Start it.
-            logger.info(f"No global lock found for node {node.id}. Queueing start task.")
-            start_mqtt_monitoring.delay(node.id)
-            started_count += 1
+            logger.info(f"No global lock found for node {node_id}. Queueing start task.")
+            to_start.append(node_id)
         
-        if started_count > 0:
-            logger.info(f"Started monitoring for {started_count} nodes")
+        if to_start:
+            # A group publishes all start tasks with one pooled producer
+            group(start_mqtt_monitoring.s(node_id) for node_id in to_start).apply_async()
+            logger.info(f"Started monitoring for {len(to_start)} nodes")
         else:
             logger.info("All active nodes are already being monitored (locks present)")
     
@@ -148,6 +213,15 @@ def cleanup_stale_mqtt_locks():
         logger.error(f"Error cleaning up stale locks: {e}", exc_info=True)
 
 
+@shared_task
+def beat_heartbeat():
+    """
+    Celery beat task proving that beat is scheduling and a worker is consuming.
+    Run this every minute.
+    """
+    cache.set(BEAT_HEARTBEAT_KEY, time.time(), timeout=BEAT_HEARTBEAT_TTL)
+
+
 @shared_task
 def health_check_mqtt_clients():
     """
@@ -156,6 +230,7 @@ def health_check_mqtt_clients():
     """
     try:
         logger.info("Running MQTT client health check")
+        mqtt_monitoring_service.update_all_statuses()
         health_report = mqtt_monitoring_service.get_health_report()
         
         logger.info(
@@ -164,14 +239,12 @@ def health_check_mqtt_clients():
         )
         
         # Log details of unhealthy nodes
-        for node_id, node_info in health_report['nodes'].items():
-            if not node_info['healthy']:
-                stats = node_info['stats']
-                logger.warning(
-                    f"Unhealthy node {node_id} ({stats['node_name']}): "
-                    f"state={stats['state']}, error_count={stats['error_count']}, "
-                    f"last_error={stats['last_error']}"
-                )
+        for stats in health_report['unhealthy']:
+            logger.warning(
+                f"Unhealthy node {stats['node_id']} ({stats['node_name']}): "
+                f"state={stats['state']}, error_count={stats['error_count']}, "
+                f"last_error={stats['last_error']}"
+            )
         
         return health_report
     
@@ -180,11 +253,52 @@ def health_check_mqtt_clients():
         return None
 
 
-def _prepare_observation_record(node_id: int, payload: dict) -> StationMQTTMessageLog | None:
+if sys.version_info >= (3, 11):
+    # Accepts the trailing 'Z' natively
+    _fromisoformat = datetime.fromisoformat
+else:
+    def _fromisoformat(value: str) -> datetime:
+        if value.endswith('Z'):
+            value = value[:-1] + '+00:00'
+        return datetime.fromisoformat(value)
+
+
+def _parse_datetime(value: str) -> datetime:
+    """Parse an ISO 8601 string into an aware datetime, assuming UTC if naive"""
+    dt = _fromisoformat(value)
+    return dt if dt.tzinfo else dt.replace(tzinfo=timezone.utc)
+
+
+# zstd compression contexts can't be shared between threads
+_zstd = threading.local()
+
+
+def _compress_message(data: bytes) -> bytes:
+    """Compress a raw JSON message for StationMQTTMessageLog.raw_message"""
+    compressor = getattr(_zstd, 'compressor', None)
+    if compressor is None:
+        compressor = _zstd.compressor = zstandard.ZstdCompressor(level=3)
+    return compressor.compress(data)
+
+
+def _decode_batch_payload(item: dict) -> dict:
+    """
+    Return the decoded payload of a batch item.
+    Clients forward the raw MQTT payload bytes so it is parsed only once, here.
+    """
+    if 'payload_raw' in item:
+        return orjson.loads(item['payload_raw'])
+    # Batches queued before payloads were sent as msgpack bytes
+    if 'payload_b64' in item:
+        return orjson.loads(base64.b64decode(item['payload_b64']))
+    return item['payload']
+
+
+def _parse_payload(payload: dict, raw: bytes = None) -> dict | None:
     """
-    Helper function to parse payload and prepare a StationMQTTMessageLog instance.
-    Returns None if validation fails or required objects (Station/Dataset) are missing.
-    Does NOT save the record to the database.
+    Extract the fields needed for a StationMQTTMessageLog from a notification payload.
+    Pure parsing, no database access. Returns None if required fields are missing.
+    raw is the payload as received, stored as is instead of re-serializing it.
     """
     # [cite_start]1. Extract IDs [cite: 865, 866, 867]
     message_id = payload.get('id')
@@ -193,126 +307,325 @@ def _prepare_observation_record(node_id: int, payload: dict) -> StationMQTTMessa
     metadata_id = properties.get('metadata_id')
     
     if not message_id or not wigos_id or not metadata_id:
-        logger.warning(
-            f"Message missing required fields (ID: {message_id}, WIGOS: {wigos_id}, Metadata: {metadata_id})")
-        return None
-    
-    # [cite_start]2. Find Station (with Sync Fallback) [cite: 868-872]
-    try:
-        station = Station.objects.get(wigos_id=wigos_id)
-    except Station.DoesNotExist:
-        # Attempt metadata sync if station missing
-        try:
-            logger.info(f"Station {wigos_id} missing. Triggering sync for node {node_id}...")
-            sync_metadata(node_id)
-            station = Station.objects.get(wigos_id=wigos_id)
-        except Station.DoesNotExist:
-            logger.error(f"Station {wigos_id} not found even after metadata sync.")
-            return None
-        except Exception as e:
-            logger.error(f"Error during metadata sync resolution: {e}")
-            raise e  # Let the caller handle retry logic
-    
-    # [cite_start]3. Find Dataset [cite: 872-873]
-    try:
-        dataset = Dataset.objects.get(identifier=metadata_id)
-    except Dataset.DoesNotExist:
-        logger.warning(f"Dataset not found for metadata_id {metadata_id}")
+        logger.warning("Message missing required fields (ID: %s, WIGOS: %s, Metadata: %s)",
+                       message_id, wigos_id, metadata_id)
         return None
     
-    # [cite_start]4. Parse Timestamps [cite: 874-878]
+    # [cite_start]2. Parse Timestamps [cite: 874-878]
     observation_datetime = None
     publish_datetime = dj_timezone.now()
     
     try:
         if dt_str := properties.get('datetime'):
-            dt = datetime.fromisoformat(dt_str.replace('Z', '+00:00'))
-            observation_datetime = dt if dt.tzinfo else dt.replace(tzinfo=timezone.utc)
+            observation_datetime = _parse_datetime(dt_str)
         
         if pubtime_str := properties.get('pubtime'):
-            pt = datetime.fromisoformat(pubtime_str.replace('Z', '+00:00'))
-            publish_datetime = pt if pt.tzinfo else pt.replace(tzinfo=timezone.utc)
+            publish_datetime = _parse_datetime(pubtime_str)
     except ValueError as e:
-        logger.warning(f"Error parsing timestamps for message {message_id}: {e}")
+        logger.warning("Error parsing timestamps for message %s: %s", message_id, e)
         # Continue with defaults if possible, or return None if critical
     
-    # [cite_start]5. Extract Link [cite: 879]
+    # [cite_start]3. Extract Link [cite: 879]
     links = payload.get('links', [])
     canonical_link = next((link.get('href', '') for link in links if link.get('rel') == 'canonical'), '')
     
-    # [cite_start]6. Instantiate Object (Unsaved) [cite: 880]
+    return {
+        'message_id': message_id,
+        'wigos_id': wigos_id,
+        'metadata_id': metadata_id,
+        'data_id': properties.get('data_id', ''),
+        'time': observation_datetime,
+        'publish_datetime': publish_datetime,
+        'canonical_link': canonical_link,
+        'raw_message': _compress_message(raw if raw is not None else orjson.dumps(payload)),
+    }
+
+
+def _build_record(parsed: dict, station_id: int, dataset_id: int) -> StationMQTTMessageLog:
+    """
+    Instantiate an unsaved StationMQTTMessageLog from a parsed payload.
+    Foreign keys are set by primary key, no Station/Dataset instances needed.
+    """
+    # [cite_start]Instantiate Object (Unsaved) [cite: 880]
     return StationMQTTMessageLog(
-        station=station,
-        dataset=dataset,
-        message_id=message_id,
-        data_id=properties.get('data_id', ''),
-        time=observation_datetime,
-        publish_datetime=publish_datetime,
-        canonical_link=canonical_link,
-        raw_json=payload
+        station_id=station_id,
+        dataset_id=dataset_id,
+        message_id=parsed['message_id'],
+        data_id=parsed['data_id'],
+        time=parsed['time'],
+        publish_datetime=parsed['publish_datetime'],
+        canonical_link=parsed['canonical_link'],
+        raw_message=parsed['raw_message']
+    )
+
+
+def _sync_metadata_throttled(node_id: int) -> bool:
+    """
+    Sync metadata for a node unless another sync was triggered within
+    SYNC_METADATA_THROTTLE seconds. Returns True if the sync ran.
+    """
+    throttle_key = f"sync_metadata_lock_{node_id}"
+    if not cache.add(throttle_key, '1', timeout=SYNC_METADATA_THROTTLE):
+        logger.debug(f"Metadata sync for node {node_id} ran recently, skipping")
+        return False
+    
+    try:
+        sync_metadata(node_id)
+    except Exception:
+        # Let the next attempt try again
+        cache.delete(throttle_key)
+        raise
+    finally:
+        # Stations or datasets may have been replaced
+        _bump_pk_cache_generation()
+    return True
+
+
+# lookup value -> (primary key, monotonic expiry)
+_station_pk_cache = {}
+_dataset_pk_cache = {}
+# Last PK_CACHE_GENERATION_KEY value seen by this process
+_pk_cache_generation = None
+
+
+def _cached_ids(pk_cache: dict, values, query) -> dict:
+    """
+    Map values to primary keys, querying only those not cached or expired.
+    Values without a row aren't cached, so rows created later are picked up.
+    """
+    now = time.monotonic()
+    found = {}
+    misses = []
+    for value in values:
+        entry = pk_cache.get(value)
+        if entry is not None and entry[1] > now:
+            found[value] = entry[0]
+        else:
+            misses.append(value)
+    
+    if misses:
+        fetched = query(misses)
+        if len(pk_cache) + len(fetched) > PK_CACHE_MAX_SIZE:
+            pk_cache.clear()
+        expires_at = now + PK_CACHE_TTL
+        for value, pk in fetched.items():
+            pk_cache[value] = (pk, expires_at)
+        found.update(fetched)
+    
+    return found
+
+
+def _clear_pk_caches():
+    _station_pk_cache.clear()
+    _dataset_pk_cache.clear()
+
+
+def _bump_pk_cache_generation():
+    """Make every worker process drop its cached primary keys before its next batch"""
+    cache.set(PK_CACHE_GENERATION_KEY, time.time_ns(), timeout=None)
+
+
+def _check_pk_cache_generation():
+    """Drop the cached primary keys if Stations or Datasets changed in any process"""
+    global _pk_cache_generation
+    generation = cache.get(PK_CACHE_GENERATION_KEY)
+    if generation != _pk_cache_generation:
+        _clear_pk_caches()
+        _pk_cache_generation = generation
+
+
+def _station_ids(wigos_ids) -> dict:
+    """Map WIGOS ids to Station primary keys"""
+    return _cached_ids(
+        _station_pk_cache, wigos_ids,
+        lambda misses: dict(Station.objects.filter(wigos_id__in=misses).values_list('wigos_id', 'id'))
+    )
+
+
+def _dataset_ids(identifiers) -> dict:
+    """Map dataset identifiers to Dataset primary keys"""
+    return _cached_ids(
+        _dataset_pk_cache, identifiers,
+        lambda misses: dict(Dataset.objects.filter(identifier__in=misses).values_list('identifier', 'id'))
     )
 
 
+def _resolve_batch_records(parsed_items: list) -> list:
+    """
+    Resolve Stations and Datasets for a list of (node_id, parsed) pairs with bulk
+    lookups and return the unsaved StationMQTTMessageLog instances.
+    """
+    wigos_ids = {parsed['wigos_id'] for _, parsed in parsed_items}
+    metadata_ids = {parsed['metadata_id'] for _, parsed in parsed_items}
+    
+    # Once per batch, so rows deleted through another process aren't used
+    _check_pk_cache_generation()
+    
+    # Only the primary keys are needed to attach the foreign keys
+    stations = _station_ids(wigos_ids)
+    datasets = _dataset_ids(metadata_ids)
+    
+    # Sync metadata once per node that reported unknown stations, then re-query those stations
+    missing_nodes = {node_id for node_id, parsed in parsed_items if parsed['wigos_id'] not in stations}
+    synced = False
+    for node_id in missing_nodes:
+        try:
+            logger.info(f"Stations missing in batch. Triggering sync for node {node_id}...")
+            synced |= _sync_metadata_throttled(node_id)
+        except Exception as e:
+            logger.error(f"Error during metadata sync resolution for node {node_id}: {e}")
+    
+    if synced:
+        stations.update(_station_ids(wigos_ids - stations.keys()))
+        # Datasets may have been created by the sync as well
+        if unknown_datasets := metadata_ids - datasets.keys():
+            datasets.update(_dataset_ids(unknown_datasets))
+    
+    records = []
+    missing_stations = set()
+    missing_datasets = set()
+    for _, parsed in parsed_items:
+        station_id = stations.get(parsed['wigos_id'])
+        if station_id is None:
+            missing_stations.add(parsed['wigos_id'])
+            continue
+        
+        dataset_id = datasets.get(parsed['metadata_id'])
+        if dataset_id is None:
+            missing_datasets.add(parsed['metadata_id'])
+            continue
+        
+        records.append(_build_record(parsed, station_id, dataset_id))
+    
+    # One line per batch rather than per message
+    if missing_stations:
+        logger.error("Stations not found after metadata sync, messages skipped: %s", sorted(missing_stations))
+    if missing_datasets:
+        logger.warning("Datasets not found for metadata_ids, messages skipped: %s", sorted(missing_datasets))
+    
+    return records
+
+
+def _store_messages(parsed_items: list) -> int:
+    """
+    Resolve and insert (node_id, parsed) pairs in one transaction, skipping
+    duplicates. Returns the number of records inserted. bulk_create can't
+    report skipped duplicates, so smaller batches count every record sent.
+    """
+    records_to_create = _resolve_batch_records(parsed_items) if parsed_items else []
+    if not records_to_create:
+        return 0
+    
+    with transaction.atomic():
+        if len(records_to_create) > COPY_THRESHOLD:
+            return _copy_records(records_to_create)
+        
+        # ignore_conflicts=True handles duplicate message_ids gracefully,
+        # batch_size keeps each INSERT bounded for large batches
+        created = StationMQTTMessageLog.objects.bulk_create(
+            records_to_create,
+            ignore_conflicts=True,
+            batch_size=BULK_CREATE_BATCH_SIZE
+        )
+    return len(created)
+
+
+def _copy_value(value):
+    """Format a field value for COPY ... FORMAT csv, where None is NULL"""
+    if isinstance(value, (bytes, memoryview)):
+        return '\\x' + bytes(value).hex()
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return value
+
+
+def _copy_records(records: list) -> int:
+    """
+    Stream records into a temporary table with COPY, then move them into the
+    hypertable with INSERT ... ON CONFLICT DO NOTHING so duplicates are skipped
+    as with bulk_create(ignore_conflicts=True). Must run inside a transaction.
+    Returns the number of rows inserted.
+    """
+    meta = StationMQTTMessageLog._meta
+    quote_name = connection.ops.quote_name
+    fields = [meta.get_field(name) for name in COPY_FIELDS]
+    columns = ', '.join(quote_name(field.column) for field in fields)
+    # Unquoted empty CSV values are NULL unless listed here
+    not_null = ', '.join(quote_name(meta.get_field(name).column) for name in ('message_id', 'data_id', 'canonical_link'))
+    table = quote_name(meta.db_table)
+    
+    now = dj_timezone.now()
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator='\n')
+    for record in records:
+        # What the created/modified fields' pre_save would set
+        record.created = record.modified = now
+        writer.writerow([_copy_value(getattr(record, field.attname)) for field in fields])
+    buffer.seek(0)
+    
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"CREATE TEMPORARY TABLE mqtt_message_log_copy ON COMMIT DROP AS "
+            f"SELECT {columns} FROM {table} WITH NO DATA"
+        )
+        cursor.copy_expert(
+            f"COPY mqtt_message_log_copy ({columns}) FROM STDIN WITH (FORMAT csv, FORCE_NOT_NULL ({not_null}))",
+            buffer
+        )
+        cursor.execute(
+            f"INSERT INTO {table} ({columns}) SELECT {columns} FROM mqtt_message_log_copy ON CONFLICT DO NOTHING"
+        )
+        inserted = cursor.rowcount
+        # Dropped now rather than at commit, in case an outer transaction loads another batch
+        cursor.execute("DROP TABLE mqtt_message_log_copy")
+    return inserted
+
+
 @shared_task(bind=True, max_retries=3)
 def process_mqtt_message(self, node_id: int, topic: str, payload: dict, timestamp: str):
     """
     Process a single MQTT message.
+    Clients no longer dispatch this, they coalesce messages into
+    process_mqtt_message_batch. Kept for tasks still queued and manual use,
+    and stored through the same path as a batch of one.
     """
     try:
-        record = _prepare_observation_record(node_id, payload)
-        
-        if record:
-            # [cite_start]Atomic get_or_create logic to prevent duplicates [cite: 880]
-            # Since _prepare returns an instance, we use its attributes for the lookup
-            StationMQTTMessageLog.objects.get_or_create(
-                message_id=record.message_id,
-                station=record.station,
-                defaults={
-                    'dataset': record.dataset,
-                    'data_id': record.data_id,
-                    'time': record.time,
-                    'publish_datetime': record.publish_datetime,
-                    'canonical_link': record.canonical_link,
-                    'raw_json': record.raw_json
-                }
-            )
-            logger.info(f"Stored observation: {record.message_id}")
+        parsed = _parse_payload(payload)
+        if parsed and _store_messages([(node_id, parsed)]):
+            logger.debug("Stored observation: %s", parsed['message_id'])
     
     except Exception as e:
         logger.error(f"Error processing message: {e}", exc_info=True)
         raise self.retry(exc=e, countdown=30)
 
 
-@shared_task(bind=True, max_retries=3)
+@shared_task(bind=True, max_retries=3, serializer='msgpack', compression='zstd')
 def process_mqtt_message_batch(self, batch_data: list):
     """
     Process a batch of MQTT messages in a single transaction.
     Args:
         batch_data: List of dicts, each containing:
-                    {'node_id': int, 'topic': str, 'payload': dict, 'timestamp': str}
+                    {'node_id': int, 'topic': str, 'payload_raw': bytes, 'timestamp': float}
+                    where payload_raw is the raw MQTT payload and timestamp the
+                    receive time in epoch seconds.
     """
-    records_to_create = []
+    parsed_items = []
     
     try:
-        # 1. Prepare all records in memory
+        # 1. Parse all payloads in memory
         for item in batch_data:
             try:
-                record = _prepare_observation_record(item['node_id'], item['payload'])
-                if record:
-                    records_to_create.append(record)
+                parsed = _parse_payload(_decode_batch_payload(item), item.get('payload_raw'))
+                if parsed:
+                    parsed_items.append((item['node_id'], parsed))
             except Exception as e:
                 # Log individual failures but don't fail the whole batch
                 logger.error(f"Failed to prepare record in batch: {e}")
         
-        # 2. Bulk insert
-        if records_to_create:
-            with transaction.atomic():
-                # ignore_conflicts=True handles duplicate message_ids gracefully
-                created = StationMQTTMessageLog.objects.bulk_create(
-                    records_to_create,
-                    ignore_conflicts=True
-                )
-                logger.info(f"Batch processed: {len(created)} records created out of {len(batch_data)} received.")
+        # 2. Resolve Stations/Datasets with one query each and bulk insert
+        created = _store_messages(parsed_items)
+        if created:
+            logger.info(f"Batch processed: {created} records created out of {len(batch_data)} received.")
     
     except Exception as e:
         logger.error(f"Critical error processing batch: {e}", exc_info=True)
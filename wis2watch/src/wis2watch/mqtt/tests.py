@@ -0,0 +1,510 @@
+import asyncio
+import queue
+import socket
+from types import SimpleNamespace
+from unittest import mock
+
+import orjson
+from django.contrib.gis.geos import Point
+from django.core.cache import cache
+from django.test import SimpleTestCase, TestCase, override_settings
+
+from . import client, tasks
+from ..config.celery import check_single_process_pool
+from ..core.models import Dataset, Station, StationMQTTMessageLog, WIS2Node
+from .service import StartResult, mqtt_monitoring_service
+
+LOCMEM_CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class StartMonitoringCircuitBreakerTests(SimpleTestCase):
+    node_id = 1
+    
+    def setUp(self):
+        cache.clear()
+        self.failures_key = tasks._get_failures_key(self.node_id)
+        self.circuit_open_key = tasks._get_circuit_open_key(self.node_id)
+    
+    def start(self, result):
+        with mock.patch.object(mqtt_monitoring_service, 'start_node', return_value=result):
+            return tasks.start_mqtt_monitoring(self.node_id)
+    
+    def fail_starts(self, times):
+        # Called directly, the autoretry re-raises instead of queueing a retry
+        for _ in range(times):
+            with self.assertRaises(tasks.ConnectionError):
+                self.start(StartResult.CONNECT_FAILED)
+    
+    def test_connect_failures_open_the_circuit_at_the_threshold(self):
+        self.fail_starts(tasks.CIRCUIT_FAILURE_THRESHOLD - 1)
+        self.assertIsNone(cache.get(self.circuit_open_key))
+        
+        # The failure reaching the threshold opens the circuit and stops retrying
+        self.assertFalse(self.start(StartResult.CONNECT_FAILED))
+        self.assertTrue(cache.get(self.circuit_open_key))
+    
+    def test_open_circuit_skips_the_start(self):
+        cache.set(self.circuit_open_key, True)
+        
+        with mock.patch.object(mqtt_monitoring_service, 'start_node') as start_node:
+            self.assertFalse(tasks.start_mqtt_monitoring(self.node_id))
+        start_node.assert_not_called()
+    
+    def test_failed_probe_after_cooldown_reopens_the_circuit(self):
+        self.fail_starts(tasks.CIRCUIT_FAILURE_THRESHOLD - 1)
+        self.start(StartResult.CONNECT_FAILED)
+        # Cooldown elapsed, the failure count is still above the threshold
+        cache.delete(self.circuit_open_key)
+        
+        self.assertFalse(self.start(StartResult.CONNECT_FAILED))
+        self.assertTrue(cache.get(self.circuit_open_key))
+    
+    def test_successful_start_closes_the_circuit_and_resets_failures(self):
+        self.fail_starts(tasks.CIRCUIT_FAILURE_THRESHOLD - 1)
+        self.start(StartResult.CONNECT_FAILED)
+        cache.delete(self.circuit_open_key)
+        
+        self.assertTrue(self.start(StartResult.STARTED))
+        self.assertIsNone(cache.get(self.failures_key))
+        self.assertIsNone(cache.get(self.circuit_open_key))
+        
+        # Counting starts over after the reset
+        self.fail_starts(1)
+        self.assertEqual(cache.get(self.failures_key), 1)
+    
+    def test_refused_starts_are_not_retried_or_counted(self):
+        refusals = [StartResult.ALREADY_STARTING, StartResult.BACKING_OFF, StartResult.BUSY,
+                    StartResult.LOCKED, StartResult.NOT_FOUND]
+        
+        for _ in range(tasks.CIRCUIT_FAILURE_THRESHOLD):
+            for result in refusals:
+                self.assertFalse(self.start(result))
+        
+        self.assertIsNone(cache.get(self.failures_key))
+        self.assertIsNone(cache.get(self.circuit_open_key))
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class PrimaryKeyCacheTests(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+        self.pk_cache = {}
+        self.rows = {"0-404-0-1": 1, "0-404-0-2": 2}
+        self.query = mock.Mock(side_effect=lambda misses: {value: self.rows[value] for value in misses
+                                                           if value in self.rows})
+    
+    def lookup(self, *values):
+        return tasks._cached_ids(self.pk_cache, values, self.query)
+    
+    def test_cached_values_are_not_queried_again(self):
+        self.assertEqual(self.lookup("0-404-0-1", "0-404-0-2"), self.rows)
+        self.assertEqual(self.lookup("0-404-0-1", "0-404-0-2"), self.rows)
+        self.query.assert_called_once()
+    
+    def test_values_without_a_row_are_not_cached(self):
+        self.assertEqual(self.lookup("0-404-0-3"), {})
+        
+        self.rows["0-404-0-3"] = 3
+        self.assertEqual(self.lookup("0-404-0-3"), {"0-404-0-3": 3})
+    
+    def test_expired_values_are_queried_again(self):
+        with mock.patch.object(tasks.time, 'monotonic', return_value=1000.0):
+            self.lookup("0-404-0-1")
+        
+        self.rows["0-404-0-1"] = 10
+        with mock.patch.object(tasks.time, 'monotonic', return_value=1000.0 + tasks.PK_CACHE_TTL - 1):
+            self.assertEqual(self.lookup("0-404-0-1"), {"0-404-0-1": 1})
+        with mock.patch.object(tasks.time, 'monotonic', return_value=1000.0 + tasks.PK_CACHE_TTL + 1):
+            self.assertEqual(self.lookup("0-404-0-1"), {"0-404-0-1": 10})
+    
+    def test_cache_is_emptied_when_full(self):
+        with mock.patch.object(tasks, 'PK_CACHE_MAX_SIZE', 2):
+            self.lookup("0-404-0-1", "0-404-0-2")
+            self.rows["0-404-0-3"] = 3
+            self.lookup("0-404-0-3")
+        
+        self.assertEqual(set(self.pk_cache), {"0-404-0-3"})
+    
+    def test_new_generation_clears_the_process_caches(self):
+        tasks._check_pk_cache_generation()
+        tasks._station_pk_cache["0-404-0-1"] = (1, float('inf'))
+        tasks._dataset_pk_cache["urn:wmo:md:ke-test:synop"] = (1, float('inf'))
+        
+        # Same generation, the cached keys stay
+        tasks._check_pk_cache_generation()
+        self.assertIn("0-404-0-1", tasks._station_pk_cache)
+        
+        # Bumped by a sync or delete in another process
+        tasks._bump_pk_cache_generation()
+        tasks._check_pk_cache_generation()
+        self.assertEqual(tasks._station_pk_cache, {})
+        self.assertEqual(tasks._dataset_pk_cache, {})
+    
+    def test_metadata_sync_bumps_the_generation(self):
+        tasks._check_pk_cache_generation()
+        tasks._station_pk_cache["0-404-0-1"] = (1, float('inf'))
+        
+        with mock.patch.object(tasks, 'sync_metadata') as sync_metadata:
+            self.assertTrue(tasks._sync_metadata_throttled(1))
+        sync_metadata.assert_called_once_with(1)
+        
+        tasks._check_pk_cache_generation()
+        self.assertEqual(tasks._station_pk_cache, {})
+
+
+class SingleProcessPoolCheckTests(SimpleTestCase):
+    def start_worker(self, pool, concurrency):
+        check_single_process_pool(sender=SimpleNamespace(pool_cls=pool, concurrency=concurrency))
+    
+    @override_settings(WIS2WATCH_MQTT_MULTI_PROCESS=False)
+    def test_several_prefork_processes_are_refused_without_locks(self):
+        with self.assertRaises(SystemExit):
+            self.start_worker('prefork', 4)
+    
+    @override_settings(WIS2WATCH_MQTT_MULTI_PROCESS=False)
+    def test_single_process_pools_are_accepted_without_locks(self):
+        for pool, concurrency in (('solo', 4), ('threads', 4), ('prefork', 1)):
+            self.start_worker(pool, concurrency)
+    
+    @override_settings(WIS2WATCH_MQTT_MULTI_PROCESS=True)
+    def test_any_pool_is_accepted_with_locks(self):
+        self.start_worker('prefork', 4)
+
+
+class StoreMessagesCopyTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.node = WIS2Node.objects.create(name="Test Node", country="KE", base_url="https://wis2node.example.org")
+        cls.dataset = Dataset.objects.create(
+            node=cls.node,
+            identifier="urn:wmo:md:ke-test:synop",
+            title="Synop",
+            wmo_data_policy="core",
+            wmo_topic_hierarchy="origin/a/wis2/ke-test/data/core/weather/surface-based-observations/synop",
+            raw_json={},
+        )
+        cls.station = Station.objects.create(
+            wigos_id="0-404-0-63740", name="Test Station", location=Point(36.8, -1.3, 1600), raw_json={}
+        )
+    
+    def setUp(self):
+        # Primary keys of rolled back rows may be reused
+        tasks._clear_pk_caches()
+    
+    def payload(self, index):
+        payload = {
+            'id': f"message-{index}",
+            'properties': {
+                'wigos_station_identifier': self.station.wigos_id,
+                'metadata_id': self.dataset.identifier,
+                'data_id': f"ke-test/data/{index}",
+                'datetime': f"2025-01-01T{index // 60:02d}:{index % 60:02d}:00Z",
+                'pubtime': "2025-01-02T00:00:00Z",
+                'comment': "quoted \"text\", with a comma\nand a newline",
+            },
+            'links': [],
+        }
+        # Every tenth message has no canonical link, stored as an empty string
+        if index % 10:
+            payload['links'].append({'rel': 'canonical', 'href': f"https://wis2node.example.org/data/{index}.bufr4"})
+        return payload
+    
+    def parsed_items(self, indexes):
+        items = []
+        for index in indexes:
+            payload = self.payload(index)
+            items.append((self.node.id, tasks._parse_payload(payload, orjson.dumps(payload))))
+        return items
+    
+    def test_large_batch_is_copied_without_duplicates(self):
+        # Rows already stored, as when a batch is retried
+        self.assertEqual(tasks._store_messages(self.parsed_items(range(10))), 10)
+        
+        unique = tasks.COPY_THRESHOLD + 50
+        # Duplicates within the batch as well
+        items = self.parsed_items(range(unique)) + self.parsed_items(range(20))
+        self.assertGreater(len(items), tasks.COPY_THRESHOLD)
+        
+        with mock.patch.object(tasks, '_copy_records', wraps=tasks._copy_records) as copy_records:
+            self.assertEqual(tasks._store_messages(items), unique - 10)
+        copy_records.assert_called_once()
+        
+        logs = StationMQTTMessageLog.objects.filter(station=self.station)
+        self.assertEqual(logs.count(), unique)
+        self.assertEqual(logs.values('message_id').distinct().count(), unique)
+        
+        log = logs.get(message_id="message-42")
+        self.assertEqual(log.message, self.payload(42))
+        self.assertEqual(log.dataset_id, self.dataset.id)
+        self.assertEqual(log.data_id, "ke-test/data/42")
+        self.assertEqual(log.canonical_link, "https://wis2node.example.org/data/42.bufr4")
+        self.assertEqual(log.time, tasks._parse_datetime("2025-01-01T00:42:00Z"))
+        self.assertEqual(log.publish_datetime, tasks._parse_datetime("2025-01-02T00:00:00Z"))
+        self.assertIsNotNone(log.created)
+        self.assertIsNone(log.raw_json)
+        
+        self.assertEqual(logs.get(message_id="message-40").canonical_link, "")
+    
+    def test_copy_can_run_twice_in_one_transaction(self):
+        items = self.parsed_items(range(tasks.COPY_THRESHOLD + 1))
+        
+        self.assertEqual(tasks._store_messages(items), len(items))
+        self.assertEqual(tasks._store_messages(items), 0)
+
+
+SYNOP_TOPIC = "origin/a/wis2/ke-test/data/core/weather/surface-based-observations/synop"
+TEMP_TOPIC = "origin/a/wis2/ke-test/data/core/weather/surface-based-observations/temp"
+CACHE_TOPIC = "cache/a/wis2/#"
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class StubbedPahoTestCase(SimpleTestCase):
+    """Runs clients against stub Paho clients, with the event loop and background threads mocked out"""
+    
+    def setUp(self):
+        cache.clear()
+        self.loop = mock.Mock()
+        # Coroutines handed to the loop are never run
+        self.loop.create_task.side_effect = lambda coro: coro.close() or mock.Mock()
+        
+        patchers = [
+            # A separate stub client for every connection
+            mock.patch.object(client.mqtt, 'Client', side_effect=lambda **kwargs: mock.Mock()),
+            mock.patch.object(client, '_get_broadcast_loop', return_value=self.loop),
+            mock.patch.object(client, '_get_layer', return_value=None),
+            mock.patch.object(client, '_ensure_background_threads'),
+            mock.patch.object(client.MQTTBrokerConnection, '_connections', {}),
+        ]
+        mocks = [patcher.start() for patcher in patchers]
+        for patcher in patchers:
+            self.addCleanup(patcher.stop)
+        self.paho_client = mocks[0]
+    
+    def node(self, node_id, topics, broker_host="broker.example.org"):
+        node = client.MQTTNodeClient(node_id, f"Node {node_id}", broker_host, 1883, topics=topics)
+        self.assertTrue(node.connect())
+        return node
+    
+    def connected(self, connection):
+        connection._on_connect(connection.client, None, None, 0)
+    
+    def deliver(self, connection, topic, payload=b'{}'):
+        connection._on_message(connection.client, None, SimpleNamespace(topic=topic, payload=payload))
+
+
+class MQTTBrokerConnectionTests(StubbedPahoTestCase):
+    def node(self, node_id, topics, broker_host="broker.example.org"):
+        node = super().node(node_id, topics, broker_host)
+        node._message_handler = mock.Mock()
+        return node
+    
+    def test_nodes_on_one_broker_share_a_connection(self):
+        node_a = self.node(1, [SYNOP_TOPIC])
+        node_b = self.node(2, [TEMP_TOPIC])
+        node_c = self.node(3, [SYNOP_TOPIC], broker_host="other.example.org")
+        
+        connection = node_a._connection
+        self.assertIs(node_b._connection, connection)
+        self.assertIsNot(node_c._connection, connection)
+        self.assertEqual(self.paho_client.call_count, 2)
+        
+        connection.client.connect_async.assert_called_once_with(
+            "broker.example.org", 1883, keepalive=client.MQTTBrokerConnection.KEEPALIVE
+        )
+        self.loop.call_soon_threadsafe.assert_any_call(connection._start_connecting)
+    
+    def test_connect_subscribes_every_filter_once(self):
+        node_a = self.node(1, [SYNOP_TOPIC, TEMP_TOPIC])
+        node_b = self.node(2, [SYNOP_TOPIC])
+        connection = node_a._connection
+        
+        self.connected(connection)
+        
+        connection.client.subscribe.assert_called_once_with([(SYNOP_TOPIC, 1), (TEMP_TOPIC, 1)])
+        self.assertEqual(node_a.state, client.ClientState.CONNECTED)
+        self.assertEqual(node_b.state, client.ClientState.CONNECTED)
+    
+    def test_node_joining_a_live_connection_is_subscribed(self):
+        node_a = self.node(1, [SYNOP_TOPIC])
+        connection = node_a._connection
+        self.connected(connection)
+        connection.client.subscribe.reset_mock()
+        
+        node_b = self.node(2, [SYNOP_TOPIC, TEMP_TOPIC])
+        
+        # Subscribing again to a filter already in use is harmless
+        connection.client.subscribe.assert_called_once_with([(SYNOP_TOPIC, 1), (TEMP_TOPIC, 1)])
+        connection.client.connect_async.assert_called_once()
+        self.assertEqual(node_b.state, client.ClientState.CONNECTED)
+    
+    def test_shared_filter_is_dispatched_to_every_node(self):
+        node_a = self.node(1, [SYNOP_TOPIC])
+        node_b = self.node(2, [SYNOP_TOPIC, CACHE_TOPIC])
+        node_c = self.node(3, ["origin/a/wis2/+/data/core/#"])
+        connection = node_a._connection
+        
+        self.deliver(connection, SYNOP_TOPIC)
+        for node in (node_a, node_b, node_c):
+            node._message_handler.assert_called_once()
+        
+        msg = node_a._message_handler.call_args.args[2]
+        self.assertEqual(msg.topic, SYNOP_TOPIC)
+        
+        self.deliver(connection, "cache/a/wis2/ke-test/data/core/weather")
+        self.assertEqual(node_a._message_handler.call_count, 1)
+        self.assertEqual(node_b._message_handler.call_count, 2)
+        self.assertEqual(node_c._message_handler.call_count, 1)
+    
+    def test_detach_unsubscribes_only_unused_filters(self):
+        node_a = self.node(1, [SYNOP_TOPIC, TEMP_TOPIC])
+        node_b = self.node(2, [SYNOP_TOPIC])
+        connection = node_a._connection
+        self.connected(connection)
+        
+        node_a.disconnect()
+        
+        connection.client.unsubscribe.assert_called_once_with([TEMP_TOPIC])
+        connection.client.disconnect.assert_not_called()
+        self.assertIs(client.MQTTBrokerConnection._connections[connection.key], connection)
+        
+        self.deliver(connection, SYNOP_TOPIC)
+        self.deliver(connection, TEMP_TOPIC)
+        node_a._message_handler.assert_not_called()
+        node_b._message_handler.assert_called_once()
+    
+    def test_detach_while_disconnected_does_not_unsubscribe(self):
+        node_a = self.node(1, [SYNOP_TOPIC, TEMP_TOPIC])
+        self.node(2, [SYNOP_TOPIC])
+        connection = node_a._connection
+        
+        node_a.disconnect()
+        
+        # Filters are only subscribed on connect, from the nodes still attached
+        connection.client.unsubscribe.assert_not_called()
+        self.connected(connection)
+        connection.client.subscribe.assert_called_once_with([(SYNOP_TOPIC, 1)])
+    
+    def test_last_detach_closes_the_connection(self):
+        node_a = self.node(1, [SYNOP_TOPIC])
+        node_b = self.node(2, [SYNOP_TOPIC])
+        connection = node_a._connection
+        self.connected(connection)
+        
+        node_a.disconnect()
+        connection.client.disconnect.assert_not_called()
+        
+        node_b.disconnect()
+        # Torn down on the event loop, which owns the connection state
+        self.loop.call_soon_threadsafe.assert_called_with(connection._close)
+        connection.client.disconnect.assert_not_called()
+        connection._close()
+        connection.client.disconnect.assert_called_once()
+        self.assertTrue(connection._closing)
+        connection.client.unsubscribe.assert_not_called()
+        self.assertEqual(client.MQTTBrokerConnection._connections, {})
+        
+        # A node starting afterwards opens a new connection
+        node_c = self.node(3, [SYNOP_TOPIC])
+        self.assertIsNot(node_c._connection, connection)
+    
+    def test_socket_callbacks_are_handed_to_the_event_loop(self):
+        connection = self.node(1, [SYNOP_TOPIC])._connection
+        sock = mock.Mock()
+        sock.fileno.return_value = 5
+        
+        # Paho callbacks arrive off the loop thread
+        connection._on_socket_open(connection.client, None, sock)
+        sock.setsockopt.assert_any_call(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.loop.call_soon_threadsafe.assert_called_with(connection._watch_socket, sock)
+        self.loop.add_reader.assert_not_called()
+        
+        connection._watch_socket(sock)
+        self.loop.add_reader.assert_called_once_with(sock, connection.client.loop_read)
+        misc_task = connection._misc_task
+        self.assertIsNotNone(misc_task)
+        
+        connection._on_socket_close(connection.client, None, sock)
+        self.loop.call_soon_threadsafe.assert_called_with(connection._unwatch_socket, sock)
+        
+        connection._unwatch_socket(sock)
+        self.loop.remove_reader.assert_called_once_with(sock)
+        misc_task.cancel.assert_called_once()
+        # Connection dropped while nodes are attached, so reconnecting starts
+        self.assertTrue(connection._connecting)
+    
+    
+    def test_refused_connack_backs_off_between_reconnects(self):
+        connection = self.node(1, [SYNOP_TOPIC])._connection
+        sock = mock.Mock()
+        attempts = []
+        sleeps = []
+        
+        # Keep connect attempts to run them here instead of discarding them
+        self.loop.create_task.side_effect = attempts.append
+        self.loop.run_in_executor = mock.AsyncMock(side_effect=lambda executor, func: func())
+        
+        async def sleep(delay):
+            sleeps.append(delay)
+        
+        # Without jitter, every wait is the full delay
+        with mock.patch.object(client.asyncio, 'sleep', sleep), \
+                mock.patch.object(client.random, 'uniform', side_effect=lambda low, high: high):
+            connection._start_connecting()
+            for rc in (5, 5, 5, 5, 0, 5):
+                asyncio.run(attempts.pop())
+                # TCP connects, then the broker answers the CONNECT and
+                # closes the socket, refusing it or dropping the session later
+                connection._on_connect(connection.client, None, None, rc)
+                connection._unwatch_socket(sock)
+            asyncio.run(attempts.pop())
+        
+        delay = client.MQTTBrokerConnection.RECONNECT_MIN_DELAY
+        # Backoff only starts over after the accepted CONNACK
+        self.assertEqual(sleeps, [delay, delay * 2, delay * 4, delay * 8, delay, delay * 2])
+        self.assertEqual(connection.client.reconnect.call_count, 7)
+        self.assertEqual(attempts, [])
+
+class MQTTNodeClientIngestTests(StubbedPahoTestCase):
+    def test_messages_beyond_the_ingest_backlog_are_dropped(self):
+        ingest_q = queue.SimpleQueue()
+        # The handler binds the queue and its bound when it is built
+        with mock.patch.object(client, '_ingest_q', ingest_q), \
+                mock.patch.object(client, 'INGEST_QUEUE_MAX_SIZE', 2):
+            node = self.node(1, [SYNOP_TOPIC])
+        
+        for _ in range(3):
+            self.deliver(node._connection, SYNOP_TOPIC)
+        
+        self.assertEqual(ingest_q.qsize(), 2)
+        # Dropped messages are still counted as received
+        self.assertEqual(node.message_count, 3)
+        self.assertEqual(ingest_q.get()[:3], (node, SYNOP_TOPIC, b'{}'))
+    
+    def test_full_buffer_is_published_as_one_batch(self):
+        node = self.node(1, [SYNOP_TOPIC])
+        
+        with mock.patch.object(client.MQTTNodeClient, '_publish_batch') as publish_batch:
+            for index in range(node.BATCH_SIZE):
+                node._process_message(SYNOP_TOPIC, b'{"id": %d}' % index, 1000.0 + index, 0.0)
+        
+        publish_batch.assert_called_once()
+        batch = publish_batch.call_args.args[0]
+        self.assertEqual(len(batch), node.BATCH_SIZE)
+        self.assertEqual(batch[0], {'node_id': 1, 'topic': SYNOP_TOPIC, 'payload_raw': b'{"id": 0}',
+                                    'timestamp': 1000.0})
+        self.assertEqual(len(node._message_buffer), 0)
+    
+    @override_settings(WIS2WATCH_MQTT_USE_PRODUCER_POOL=False)
+    def test_published_batch_is_not_changed_by_later_messages(self):
+        node = self.node(1, [SYNOP_TOPIC])
+        node._process_message(SYNOP_TOPIC, b'{}', 1000.0, 0.0)
+        
+        with mock.patch.object(tasks.process_mqtt_message_batch, 'delay') as delay:
+            node._flush_buffer()
+            node._process_message(TEMP_TOPIC, b'{"id": 1}', 1001.0, 0.0)
+            node._flush_buffer()
+        
+        self.assertEqual(delay.call_count, 2)
+        batch = delay.call_args_list[0].args[0]
+        self.assertEqual(batch, [{'node_id': 1, 'topic': SYNOP_TOPIC, 'payload_raw': b'{}', 'timestamp': 1000.0}])
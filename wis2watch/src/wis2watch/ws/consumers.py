@@ -1,35 +1,77 @@
-import json
+import asyncio
+import logging
 
+import orjson
+from asgiref.sync import sync_to_async
 from channels.db import database_sync_to_async
 from channels.generic.websocket import AsyncWebsocketConsumer
 from django.core.cache import cache
 
+from wis2watch.config.celery import app
+from wis2watch.mqtt.client import MQTT_STATUS_GROUP, MQTT_STATUS_SUBSCRIBERS_KEY, SUBSCRIBERS_PRESENCE_TTL
+
+logger = logging.getLogger(__name__)
+
+# Broadcast frames buffered per socket. A slow client loses the oldest
+# frames rather than growing server memory without bound.
+SEND_QUEUE_MAX_SIZE = 1000
+
+# How often each consumer refreshes the subscriber presence key, well
+# within its TTL so one missed refresh doesn't let it expire
+SUBSCRIBERS_PRESENCE_INTERVAL = SUBSCRIBERS_PRESENCE_TTL / 3
+
+
+def _dumps(data) -> str:
+    # Node status dicts are keyed by integer node id
+    return orjson.dumps(data, option=orjson.OPT_NON_STR_KEYS).decode()
+
+
+def _mark_subscribed():
+    cache.set(MQTT_STATUS_SUBSCRIBERS_KEY, True, timeout=SUBSCRIBERS_PRESENCE_TTL)
+
+
+def _queue_node_task(task_name, node_id):
+    # Publish by name on a pooled producer, without importing the tasks module
+    # or opening a broker connection per click
+    with app.producer_pool.acquire(block=True) as producer:
+        app.send_task(task_name, args=(int(node_id),), producer=producer)
+
 
 class MQTTStatusConsumer(AsyncWebsocketConsumer):
     async def connect(self):
-        await self.channel_layer.group_add("mqtt_status", self.channel_name)
+        # Group frames queue up until the initial status has been sent
+        self._send_queue = asyncio.Queue(maxsize=SEND_QUEUE_MAX_SIZE)
+        self._sender = None
+        
+        await self.channel_layer.group_add(MQTT_STATUS_GROUP, self.channel_name)
         await self.accept()
+        self._presence = asyncio.create_task(self._refresh_presence())
         
         # Send initial status
         status = await self.get_mqtt_status()
-        await self.send(text_data=json.dumps({
+        await self.send(text_data=_dumps({
             'type': 'status',
             'data': status
         }))
+        self._sender = asyncio.create_task(self._drain_send_queue())
     
     async def disconnect(self, close_code):
-        await self.channel_layer.group_discard("mqtt_status", self.channel_name)
+        for task in (getattr(self, '_sender', None), getattr(self, '_presence', None)):
+            if task is not None:
+                task.cancel()
+        # The presence key is left to expire, other consumers may still be connected
+        await self.channel_layer.group_discard(MQTT_STATUS_GROUP, self.channel_name)
     
     async def receive(self, text_data):
         """Handle incoming WebSocket messages"""
         try:
-            data = json.loads(text_data)
+            data = orjson.loads(text_data)
             action = data.get('action')
             node_id = data.get('node_id')
             
             if action == 'start':
                 await self.start_node(node_id)
-                await self.send(text_data=json.dumps({
+                await self.send(text_data=_dumps({
                     'type': 'action_result',
                     'action': 'start',
                     'node_id': node_id,
@@ -38,7 +80,7 @@ class MQTTStatusConsumer(AsyncWebsocketConsumer):
             
             elif action == 'stop':
                 await self.stop_node(node_id)
-                await self.send(text_data=json.dumps({
+                await self.send(text_data=_dumps({
                     'type': 'action_result',
                     'action': 'stop',
                     'node_id': node_id,
@@ -47,7 +89,7 @@ class MQTTStatusConsumer(AsyncWebsocketConsumer):
             
             elif action == 'restart':
                 await self.restart_node(node_id)
-                await self.send(text_data=json.dumps({
+                await self.send(text_data=_dumps({
                     'type': 'action_result',
                     'action': 'restart',
                     'node_id': node_id,
@@ -56,38 +98,49 @@ class MQTTStatusConsumer(AsyncWebsocketConsumer):
             
             elif action == 'get_status':
                 status = await self.get_mqtt_status()
-                await self.send(text_data=json.dumps({
+                await self.send(text_data=_dumps({
                     'type': 'status',
                     'data': status
                 }))
         
         except Exception as e:
-            await self.send(text_data=json.dumps({
+            await self.send(text_data=_dumps({
                 'type': 'error',
                 'error': str(e)
             }))
     
-    async def status_update(self, event):
-        """Handle status update messages from group"""
-        await self.send(text_data=json.dumps({
-            'type': 'status_update',
-            'data': event['status']
-        }))
+    async def statuses_updated(self, event):
+        """Forward a coalesced batch of pre-encoded status_update frames"""
+        for frame in event['frames']:
+            self._enqueue_frame(frame)
     
-    async def message_received(self, event):
-        """Handle message received notifications"""
-        
-        payload = event['payload']
-        
-        await self.send(text_data=json.dumps({
-            'type': 'message',
-            'data': {
-                'node_id': event['node_id'],
-                'topic': event['topic'],
-                'timestamp': event['timestamp'],
-                "geometry": payload.get('geometry'),
-            }
-        }))
+    async def messages_received(self, event):
+        """Forward a coalesced batch of pre-encoded message frames"""
+        for frame in event['frames']:
+            self._enqueue_frame(frame)
+    
+    def _enqueue_frame(self, frame):
+        try:
+            self._send_queue.put_nowait(frame)
+        except asyncio.QueueFull:
+            # Drop the oldest frame to make room
+            self._send_queue.get_nowait()
+            self._send_queue.put_nowait(frame)
+    
+    async def _refresh_presence(self):
+        """Keep the subscriber presence key alive while the socket is open"""
+        while True:
+            try:
+                await sync_to_async(_mark_subscribed)()
+            except Exception as e:
+                logger.error("Failed to refresh status subscriber presence: %s", e)
+            await asyncio.sleep(SUBSCRIBERS_PRESENCE_INTERVAL)
+    
+    async def _drain_send_queue(self):
+        """Send queued group frames to the socket, one at a time"""
+        while True:
+            frame = await self._send_queue.get()
+            await self.send(text_data=frame)
     
     @database_sync_to_async
     def get_mqtt_status(self):
@@ -95,17 +148,19 @@ class MQTTStatusConsumer(AsyncWebsocketConsumer):
         from wis2watch.core.models import WIS2Node
         
         status = {}
-        active_nodes = WIS2Node.objects.all()
+        node_ids = list(WIS2Node.objects.values_list('id', flat=True))
+        
+        # One round trip for all nodes
+        cached = cache.get_many([f"mqtt_node_{node_id}_status" for node_id in node_ids])
         
-        for node in active_nodes:
-            cache_key = f"mqtt_node_{node.id}_status"
-            node_status = cache.get(cache_key)
+        for node_id in node_ids:
+            node_status = cached.get(f"mqtt_node_{node_id}_status")
             
             if node_status:
-                status[node.id] = node_status
+                status[node_id] = node_status
             else:
-                status[node.id] = {
-                    'node_id': node.id,
+                status[node_id] = {
+                    'node_id': node_id,
                     'status': 'unknown',
                     'last_update': None,
                     'error': None
@@ -113,23 +168,17 @@ class MQTTStatusConsumer(AsyncWebsocketConsumer):
         
         return status
     
-    @database_sync_to_async
-    def start_node(self, node_id):
+    async def start_node(self, node_id):
         """Queue start task in Celery"""
-        from wis2watch.mqtt.tasks import start_mqtt_monitoring
-        start_mqtt_monitoring.delay(int(node_id))
+        await sync_to_async(_queue_node_task)('wis2watch.mqtt.tasks.start_mqtt_monitoring', node_id)
         return True
     
-    @database_sync_to_async
-    def stop_node(self, node_id):
+    async def stop_node(self, node_id):
         """Queue stop task in Celery"""
-        from wis2watch.mqtt.tasks import stop_mqtt_monitoring
-        stop_mqtt_monitoring.delay(int(node_id))
+        await sync_to_async(_queue_node_task)('wis2watch.mqtt.tasks.stop_mqtt_monitoring', node_id)
         return True
     
-    @database_sync_to_async
-    def restart_node(self, node_id):
+    async def restart_node(self, node_id):
         """Queue restart task in Celery"""
-        from wis2watch.mqtt.tasks import restart_mqtt_monitoring
-        restart_mqtt_monitoring.delay(int(node_id))
+        await sync_to_async(_queue_node_task)('wis2watch.mqtt.tasks.restart_mqtt_monitoring', node_id)
         return True
@@ -0,0 +1,71 @@
+import asyncio
+from unittest import mock
+
+from django.core.cache import cache
+from django.test import SimpleTestCase, override_settings
+
+from wis2watch.mqtt import client
+
+from . import consumers
+
+LOCMEM_CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class SubscriberPresenceTests(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+    
+    def has_subscribers(self):
+        # Skip the refresh interval so every call reads the cache
+        client._subscribers_checked_at = None
+        return client._has_subscribers()
+    
+    def consumer(self, name):
+        consumer = consumers.MQTTStatusConsumer()
+        consumer.channel_layer = mock.AsyncMock()
+        consumer.channel_name = name
+        return consumer
+    
+    def test_presence_follows_refreshes(self):
+        self.assertFalse(self.has_subscribers())
+        
+        consumers._mark_subscribed()
+        self.assertTrue(self.has_subscribers())
+    
+    def test_evicted_presence_is_restored_by_the_next_refresh(self):
+        consumers._mark_subscribed()
+        cache.delete(client.MQTT_STATUS_SUBSCRIBERS_KEY)
+        self.assertFalse(self.has_subscribers())
+        
+        consumers._mark_subscribed()
+        self.assertTrue(self.has_subscribers())
+    
+    def test_presence_expires_without_refreshes(self):
+        # As when the consumer process died without disconnecting
+        with mock.patch('django.core.cache.backends.locmem.time.time', return_value=1000.0):
+            consumers._mark_subscribed()
+        
+        with mock.patch('django.core.cache.backends.locmem.time.time',
+                        return_value=1000.0 + client.SUBSCRIBERS_PRESENCE_TTL - 1):
+            self.assertTrue(self.has_subscribers())
+        with mock.patch('django.core.cache.backends.locmem.time.time',
+                        return_value=1000.0 + client.SUBSCRIBERS_PRESENCE_TTL + 1):
+            self.assertFalse(self.has_subscribers())
+    
+    async def test_leaving_consumer_keeps_presence_for_the_others(self):
+        staying = self.consumer("staying")
+        leaving = self.consumer("leaving")
+        
+        with mock.patch.object(consumers, 'SUBSCRIBERS_PRESENCE_INTERVAL', 0.01):
+            for consumer in (staying, leaving):
+                consumer._presence = asyncio.create_task(consumer._refresh_presence())
+            await asyncio.sleep(0.05)
+            
+            # Evicted while both are connected, then one of them leaves
+            cache.delete(client.MQTT_STATUS_SUBSCRIBERS_KEY)
+            await leaving.disconnect(1000)
+            await asyncio.sleep(0.05)
+            
+            self.assertTrue(self.has_subscribers())
+            staying._presence.cancel()